@@ -0,0 +1,21 @@
+-- Migration 004: Covering index for POI enrichment
+--
+-- Run with: psql -d blyth_twin -f 004_add_buildings_enrichment_index.sql
+
+-- ============================================================================
+-- ENRICHMENT COVERING INDEX
+-- ============================================================================
+-- Lets 22_enrich_buildings.py check which matched buildings still have NULL
+-- name/amenity/shop/address fields with an index-only scan
+
+CREATE INDEX IF NOT EXISTS idx_buildings_enrichment
+    ON buildings (osm_id)
+    INCLUDE (name, amenity, shop, addr_street, addr_postcode, addr_city, addr_housenumber);
+
+ANALYZE buildings;
+
+-- ============================================================================
+-- DONE
+-- ============================================================================
+
+SELECT 'Migration 004 complete: idx_buildings_enrichment created' as status;
@@ -0,0 +1,30 @@
+-- Migration 005: Spatial index on building centroids
+--
+-- Run with: psql -d blyth_twin -f 005_add_buildings_centroid_index.sql
+
+-- ============================================================================
+-- CENTROID GiST INDEX
+-- ============================================================================
+-- Lets 22_enrich_buildings.py match POIs to their nearest building with an
+-- index-assisted KNN (<->) search instead of scanning every centroid
+
+CREATE INDEX IF NOT EXISTS idx_buildings_centroid
+    ON buildings USING gist (centroid);
+
+ANALYZE buildings;
+
+-- ============================================================================
+-- OPTIONAL MAINTENANCE (one-off, run by hand)
+-- ============================================================================
+-- Physically ordering rows by the index keeps nearby buildings on the same
+-- pages. CLUSTER rewrites the whole table under an ACCESS EXCLUSIVE lock, so
+-- only run it in a maintenance window:
+--
+--   CLUSTER buildings USING idx_buildings_centroid;
+--   ANALYZE buildings;
+
+-- ============================================================================
+-- DONE
+-- ============================================================================
+
+SELECT 'Migration 005 complete: idx_buildings_centroid created' as status;
@@ -32,6 +32,9 @@ SCRIPT_DIR = Path(__file__).parent
 CONFIG_DIR = SCRIPT_DIR.parent / "config"
 SETTINGS_FILE = CONFIG_DIR / "settings.yaml"
 
+# Coordinate transformer
+WGS84_TO_BNG = Transformer.from_crs("EPSG:4326", "EPSG:27700", always_xy=True)
+
 
 def get_twin_paths(twin_id: str):
     """Get paths for twin-specific execution."""
@@ -62,8 +65,7 @@ def create_aoi(centre_lat: float, centre_lon: float, side_length_m: float, buffe
         GeoJSON FeatureCollection
     """
     # Transform centre point from WGS84 to BNG
-    transformer_to_bng = Transformer.from_crs("EPSG:4326", "EPSG:27700", always_xy=True)
-    centre_x, centre_y = transformer_to_bng.transform(centre_lon, centre_lat)
+    centre_x, centre_y = WGS84_TO_BNG.transform(centre_lon, centre_lat)
 
     # Create square AOI
     half_side = side_length_m / 2
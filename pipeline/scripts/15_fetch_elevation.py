@@ -30,6 +30,7 @@ import numpy as np
 import rasterio
 from rasterio.transform import from_bounds
 from pyproj import Transformer
+from pyproj.aoi import AreaOfInterest
 import requests
 
 # Add parent directory to path for imports
@@ -39,9 +40,14 @@ sys.path.insert(0, str(PIPELINE_DIR))
 
 from lib.twin_config import get_twin_config, is_in_england
 
-# Coordinate transformers
-WGS84_TO_BNG = Transformer.from_crs("EPSG:4326", "EPSG:27700", always_xy=True)
-BNG_TO_WGS84 = Transformer.from_crs("EPSG:27700", "EPSG:4326", always_xy=True)
+# Coordinate transformers (area of interest = EPSG:27700 area of use, so PROJ
+# picks the GB pipeline once at construction time)
+GB_AREA = AreaOfInterest(
+    west_lon_degree=-9.0, south_lat_degree=49.75,
+    east_lon_degree=2.01, north_lat_degree=61.01,
+)
+WGS84_TO_BNG = Transformer.from_crs("EPSG:4326", "EPSG:27700", always_xy=True, area_of_interest=GB_AREA)
+BNG_TO_WGS84 = Transformer.from_crs("EPSG:27700", "EPSG:4326", always_xy=True, area_of_interest=GB_AREA)
 
 # EA LIDAR Composite WCS endpoints (1m resolution, ~99% England coverage)
 EA_DTM_WCS_URL = "https://environment.data.gov.uk/spatialdata/lidar-composite-digital-terrain-model-dtm-1m/wcs"
@@ -182,8 +188,9 @@ def fetch_opentopo_fallback(min_lat: float, max_lat: float, min_lon: float, max_
         # Reshape and save
         elevation_grid = np.array(elevations, dtype=np.float32).reshape(n_rows, n_cols)
 
-        min_x, min_y = WGS84_TO_BNG.transform(min_lon, min_lat)
-        max_x, max_y = WGS84_TO_BNG.transform(max_lon, max_lat)
+        min_x, min_y, max_x, max_y = WGS84_TO_BNG.transform_bounds(
+            min_lon, min_lat, max_lon, max_lat, densify_pts=21
+        )
         transform = from_bounds(min_x, min_y, max_x, max_y, n_cols, n_rows)
 
         output_path.parent.mkdir(parents=True, exist_ok=True)
@@ -234,9 +241,10 @@ def main(twin_id: str) -> int:
     min_y = center_y - half_side
     max_y = center_y + half_side
 
-    # WGS84 bounds for fallback
-    min_lon, min_lat = BNG_TO_WGS84.transform(min_x, min_y)
-    max_lon, max_lat = BNG_TO_WGS84.transform(max_x, max_y)
+    # WGS84 bounds for fallback (densified edges cover the whole square)
+    min_lon, min_lat, max_lon, max_lat = BNG_TO_WGS84.transform_bounds(
+        min_x, min_y, max_x, max_y, densify_pts=21
+    )
 
     in_england = is_in_england(config.centre_lat, config.centre_lon)
     dtm_success = False
@@ -23,6 +23,7 @@ import numpy as np
 import rasterio
 from rasterio.transform import from_bounds
 from pyproj import Transformer
+from pyproj.aoi import AreaOfInterest
 import requests
 
 # Add parent directory to path for imports
@@ -32,9 +33,14 @@ sys.path.insert(0, str(PIPELINE_DIR))
 
 from lib.twin_config import get_twin_config
 
-# Coordinate transformers
-WGS84_TO_BNG = Transformer.from_crs("EPSG:4326", "EPSG:27700", always_xy=True)
-BNG_TO_WGS84 = Transformer.from_crs("EPSG:27700", "EPSG:4326", always_xy=True)
+# Coordinate transformers (area of interest = EPSG:27700 area of use, so PROJ
+# picks the GB pipeline once at construction time)
+GB_AREA = AreaOfInterest(
+    west_lon_degree=-9.0, south_lat_degree=49.75,
+    east_lon_degree=2.01, north_lat_degree=61.01,
+)
+WGS84_TO_BNG = Transformer.from_crs("EPSG:4326", "EPSG:27700", always_xy=True, area_of_interest=GB_AREA)
+BNG_TO_WGS84 = Transformer.from_crs("EPSG:27700", "EPSG:4326", always_xy=True, area_of_interest=GB_AREA)
 
 # Open-Elevation API (free, no API key required)
 OPEN_ELEVATION_URL = "https://api.open-elevation.com/api/v1/lookup"
@@ -127,8 +133,9 @@ def save_dem_geotiff(elevation_grid: np.ndarray, output_path: Path,
     Save elevation grid as a GeoTIFF in BNG projection.
     """
     # Convert bounds to BNG
-    min_x, min_y = WGS84_TO_BNG.transform(min_lon, min_lat)
-    max_x, max_y = WGS84_TO_BNG.transform(max_lon, max_lat)
+    min_x, min_y, max_x, max_y = WGS84_TO_BNG.transform_bounds(
+        min_lon, min_lat, max_lon, max_lat, densify_pts=21
+    )
 
     n_rows, n_cols = elevation_grid.shape
 
@@ -180,9 +187,10 @@ def main(twin_id: str) -> int:
     min_y = center_y - half_side
     max_y = center_y + half_side
 
-    # Convert corners back to WGS84
-    min_lon, min_lat = BNG_TO_WGS84.transform(min_x, min_y)
-    max_lon, max_lat = BNG_TO_WGS84.transform(max_x, max_y)
+    # Convert bounds back to WGS84 (densified edges cover the whole square)
+    min_lon, min_lat, max_lon, max_lat = BNG_TO_WGS84.transform_bounds(
+        min_x, min_y, max_x, max_y, densify_pts=21
+    )
 
     print(f"\nBounding box (WGS84):")
     print(f"  Lat: {min_lat:.6f} to {max_lat:.6f}")
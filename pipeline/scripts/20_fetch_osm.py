@@ -12,32 +12,71 @@ Output:
     - data/raw/osm/roads.geojson
     - data/raw/osm/water.geojson
     - data/raw/osm/coast.geojson
+    - data/raw/osm/railways.geojson
 
 Usage:
     python 20_fetch_osm.py
     python 20_fetch_osm.py --twin-id <uuid>
+    python 20_fetch_osm.py --refresh   # Ignore cached Overpass responses
 """
 
 import argparse
-import json
+import gzip
+import hashlib
+import re
 import sys
 import time
+from contextlib import ExitStack
 from pathlib import Path
+from typing import Iterable, Iterator
 
 import httpx
+import numpy as np
+import orjson
+import shapely
 import yaml
 from pyproj import Transformer
 from shapely.geometry import shape, mapping
-from shapely.ops import transform
 
 # Paths
 SCRIPT_DIR = Path(__file__).parent
 CONFIG_DIR = SCRIPT_DIR.parent / "config"
 DATA_DIR = SCRIPT_DIR.parent.parent / "data"
 OSM_DIR = DATA_DIR / "raw" / "osm"
+OVERPASS_CACHE_DIR = DATA_DIR / "cache" / "overpass"
 
 OVERPASS_URL = "https://overpass-api.de/api/interpreter"
 
+# Shared HTTP/2 client so every Overpass call reuses one pooled TLS connection
+OVERPASS_CLIENT = httpx.Client(
+    http2=True,
+    timeout=180,
+    limits=httpx.Limits(max_connections=10, max_keepalive_connections=5),
+    headers={"User-Agent": "BlythTwin/1.0"},
+)
+
+# Coordinate transformer
+BNG_TO_WGS84 = Transformer.from_crs("EPSG:27700", "EPSG:4326", always_xy=True)
+
+# Cached Overpass responses older than this are re-fetched
+OVERPASS_CACHE_MAX_AGE_S = 7 * 24 * 3600
+
+# Output layers, each written to its own GeoJSON file
+LAYERS = ("building", "road", "water", "coast", "railway")
+LAYER_FILES = {
+    "building": "buildings.geojson",
+    "road": "roads.geojson",
+    "water": "water.geojson",
+    "coast": "coast.geojson",
+    "railway": "railways.geojson",
+}
+
+# Railway types to include (matched unanchored, as Overpass does)
+RAILWAY_PATTERN = re.compile("rail|light_rail|tram|subway|narrow_gauge")
+
+# One (lon, lat) pair per item when building coordinate arrays with np.fromiter
+COORD_DTYPE = np.dtype((np.float64, 2))
+
 # Module-level paths that can be overridden for twin mode
 _config_dir = CONFIG_DIR
 _osm_dir = OSM_DIR
@@ -55,30 +94,62 @@ def get_twin_paths(twin_id: str):
     return config
 
 
-def load_aoi_bbox_wgs84() -> tuple[float, float, float, float]:
-    """Load AOI and return bounding box in WGS84 (south, west, north, east)."""
+def load_aoi_wgs84():
+    """Load the AOI polygon and return it in WGS84, prepared for repeated predicates."""
     aoi_file = _config_dir / "aoi.geojson"
-    with open(aoi_file) as f:
-        aoi = json.load(f)
+    aoi = orjson.loads(aoi_file.read_bytes())
 
     geom = shape(aoi["features"][0]["geometry"])
 
-    # Transform from BNG to WGS84
-    transformer = Transformer.from_crs("EPSG:27700", "EPSG:4326", always_xy=True)
-    geom_wgs84 = transform(transformer.transform, geom)
+    # Transform from BNG to WGS84 in one PROJ call over all vertices
+    coords = shapely.get_coordinates(geom)
+    lons, lats = BNG_TO_WGS84.transform(coords[:, 0], coords[:, 1])
+    geom_wgs84 = shapely.set_coordinates(geom, np.column_stack((lons, lats)))
+    shapely.prepare(geom_wgs84)
+    return geom_wgs84
+
 
-    bounds = geom_wgs84.bounds  # (minx, miny, maxx, maxy)
-    # Overpass wants (south, west, north, east)
+def overpass_bbox(geom) -> tuple[float, float, float, float]:
+    """Return a geometry's bounds in Overpass order (south, west, north, east)."""
+    bounds = geom.bounds  # (minx, miny, maxx, maxy)
     return (bounds[1], bounds[0], bounds[3], bounds[2])
 
 
-def query_overpass(query: str, timeout: int = 180) -> dict:
-    """Execute Overpass API query."""
+def load_aoi_bbox_wgs84() -> tuple[float, float, float, float]:
+    """Load AOI and return bounding box in WGS84 (south, west, north, east)."""
+    return overpass_bbox(load_aoi_wgs84())
+
+
+def overpass_cache_path(query: str) -> Path:
+    """Content-addressed cache file for a query (the bbox is part of the query text)."""
+    digest = hashlib.blake2b(query.encode("utf-8"), digest_size=16).hexdigest()
+    return OVERPASS_CACHE_DIR / f"{digest}.json.gz"
+
+
+def query_overpass(query: str, timeout: int = 180,
+                   max_cache_age_s: float = OVERPASS_CACHE_MAX_AGE_S) -> dict:
+    """Execute Overpass API query, reusing a fresh cached response if present."""
+    cache_file = overpass_cache_path(query)
+    if cache_file.exists():
+        age_s = time.time() - cache_file.stat().st_mtime
+        if age_s < max_cache_age_s:
+            print(f"Using cached Overpass response ({age_s / 3600:.1f}h old): {cache_file.name}")
+            with gzip.open(cache_file, "rb") as f:
+                return orjson.loads(f.read())
+
     print(f"Querying Overpass API...")
-    with httpx.Client(timeout=timeout) as client:
-        response = client.post(OVERPASS_URL, data={"data": query})
-        response.raise_for_status()
-        return response.json()
+    response = OVERPASS_CLIENT.post(OVERPASS_URL, data={"data": query}, timeout=timeout)
+    response.raise_for_status()
+    content = response.content
+
+    # Write to a temp file first so an interrupted run never leaves a truncated cache entry
+    OVERPASS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_file = cache_file.with_suffix(".tmp")
+    with gzip.open(tmp_file, "wb", compresslevel=3) as f:
+        f.write(content)
+    tmp_file.replace(cache_file)
+
+    return orjson.loads(content)
 
 
 def is_linear_waterway(tags: dict) -> bool:
@@ -89,253 +160,350 @@ def is_linear_waterway(tags: dict) -> bool:
     return waterway in linear_types
 
 
-def overpass_to_geojson(data: dict, feature_type: str) -> dict:
-    """Convert Overpass JSON to GeoJSON."""
-    features = []
-
-    # Build node lookup for ways
-    nodes = {n["id"]: (n["lon"], n["lat"]) for n in data.get("elements", []) if n["type"] == "node"}
-
-    # Build way lookup for relations
-    ways = {}
-    for element in data.get("elements", []):
-        if element["type"] == "way" and "nodes" in element:
-            coords = [nodes[nid] for nid in element["nodes"] if nid in nodes]
-            if len(coords) >= 2:
-                ways[element["id"]] = coords
-
-    for element in data.get("elements", []):
-        # Handle point features (e.g., wind turbines)
-        if element["type"] == "node" and element.get("tags"):
-            tags = element.get("tags", {})
-            tags["osm_id"] = element["id"]  # Add OSM ID
-            tags["osm_type"] = "node"
-            geometry = {
-                "type": "Point",
-                "coordinates": (element["lon"], element["lat"])
-            }
-            features.append({
-                "type": "Feature",
-                "properties": tags,
-                "geometry": geometry
-            })
-
-        elif element["type"] == "way" and "nodes" in element:
-            coords = [nodes[nid] for nid in element["nodes"] if nid in nodes]
-            if len(coords) < 2:
-                continue
-
-            tags = element.get("tags", {})
-
-            # Determine geometry type based on feature
-            if feature_type == "water":
-                # Linear waterways (streams, rivers) stay as LineStrings
-                # Area water bodies (ponds, lakes) become Polygons
-                if is_linear_waterway(tags):
-                    geom_type = "LineString"
-                else:
-                    geom_type = "Polygon"
-                    if coords[0] != coords[-1]:
-                        coords.append(coords[0])
-            elif feature_type == "building":
-                geom_type = "Polygon"
-                if coords[0] != coords[-1]:
-                    coords.append(coords[0])
-            else:
-                geom_type = "LineString"
+def way_coords(geometry: list) -> np.ndarray:
+    """Convert an inline `out geom` geometry to an (N, 2) array of lon/lat, skipping missing nodes."""
+    return np.fromiter(
+        ((pt["lon"], pt["lat"]) for pt in geometry if pt),
+        dtype=COORD_DTYPE,
+    )
 
-            geometry = {
-                "type": geom_type,
-                "coordinates": [coords] if geom_type == "Polygon" else coords
-            }
-
-            tags["osm_id"] = element["id"]  # Add OSM ID
-            tags["osm_type"] = "way"
-            features.append({
-                "type": "Feature",
-                "properties": tags,
-                "geometry": geometry
-            })
-
-        elif element["type"] == "relation" and "members" in element:
-            # Handle multipolygon relations
-            tags = element.get("tags", {})
-            outer_rings = []
-            inner_rings = []
-
-            for member in element["members"]:
-                if member["type"] == "way" and member["ref"] in ways:
-                    coords = ways[member["ref"]][:]
-                    if coords[0] != coords[-1]:
-                        coords.append(coords[0])
-                    if member.get("role") == "inner":
-                        inner_rings.append(coords)
-                    else:
-                        outer_rings.append(coords)
-
-            if outer_rings:
-                # Create polygon(s) from outer rings
-                # For simplicity, treat each outer ring as separate polygon
-                tags["osm_id"] = element["id"]  # Add OSM ID
-                tags["osm_type"] = "relation"
-                for outer in outer_rings:
-                    if len(outer) >= 4:  # Valid polygon needs at least 4 points
-                        geometry = {
-                            "type": "Polygon",
-                            "coordinates": [outer] + inner_rings
-                        }
-                        features.append({
-                            "type": "Feature",
-                            "properties": tags.copy(),  # Copy to avoid sharing between polygons
-                            "geometry": geometry
-                        })
-
-    return {
-        "type": "FeatureCollection",
-        "features": features
-    }
-
-
-def fetch_buildings(bbox: tuple) -> dict:
-    """Fetch building footprints and wind turbines."""
-    south, west, north, east = bbox
-    query = f"""
-    [out:json][timeout:180];
-    (
-      way["building"]({south},{west},{north},{east});
-      relation["building"]({south},{west},{north},{east});
-      node["man_made"="wind_turbine"]({south},{west},{north},{east});
-      node["power"="generator"]["generator:source"="wind"]({south},{west},{north},{east});
-    );
-    out body;
-    >;
-    out skel qt;
-    """
-    data = query_overpass(query)
-    return overpass_to_geojson(data, "building")
 
+def pack_way_coords(ways: list[dict]) -> tuple[np.ndarray, np.ndarray]:
+    """Pack the inline geometries of many ways into one (N, 2) lon/lat array.
 
-def fetch_roads(bbox: tuple) -> dict:
-    """Fetch roads and paths."""
-    south, west, north, east = bbox
-    query = f"""
-    [out:json][timeout:180];
-    (
-      way["highway"]({south},{west},{north},{east});
-    );
-    out body;
-    >;
-    out skel qt;
+    Way i occupies rows offsets[i]:offsets[i + 1]. Missing nodes are skipped.
     """
-    data = query_overpass(query)
-    return overpass_to_geojson(data, "road")
-
-
-def fetch_water(bbox: tuple) -> dict:
-    """Fetch water features."""
-    south, west, north, east = bbox
-    query = f"""
-    [out:json][timeout:180];
-    (
-      way["natural"="water"]({south},{west},{north},{east});
-      way["waterway"]({south},{west},{north},{east});
-      relation["natural"="water"]({south},{west},{north},{east});
-    );
-    out body;
-    >;
-    out skel qt;
+    counts = np.fromiter(
+        (sum(1 for pt in way["geometry"] if pt) for way in ways),
+        dtype=np.int64, count=len(ways),
+    )
+    offsets = np.zeros(len(ways) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    coords = np.fromiter(
+        ((pt["lon"], pt["lat"]) for way in ways for pt in way["geometry"] if pt),
+        dtype=COORD_DTYPE, count=int(offsets[-1]),
+    )
+    return coords, offsets
+
+
+def open_ring_mask(coords: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Flag packed ways whose first and last vertices differ, in one vectorised pass."""
+    firsts = offsets[:-1]
+    lasts = offsets[1:] - 1
+    mask = np.zeros(len(firsts), dtype=bool)
+    valid = lasts > firsts
+    mask[valid] = np.any(coords[firsts[valid]] != coords[lasts[valid]], axis=1)
+    return mask
+
+
+def ring_signed_areas(coords: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Twice the shoelace area of every packed ring; positive means counter-clockwise.
+
+    The closing edge wraps back to each ring's first vertex, so open and
+    closed rings give the same result.
     """
-    data = query_overpass(query)
-    return overpass_to_geojson(data, "water")
-
-
-def fetch_coastline(bbox: tuple) -> dict:
-    """Fetch coastline."""
-    south, west, north, east = bbox
-    query = f"""
-    [out:json][timeout:180];
-    (
-      way["natural"="coastline"]({south},{west},{north},{east});
-    );
-    out body;
-    >;
-    out skel qt;
+    firsts = offsets[:-1]
+    ends = offsets[1:]
+    areas = np.zeros(len(firsts))
+    nonempty = ends > firsts
+    if not nonempty.any():
+        return areas
+    nxt = np.arange(1, len(coords) + 1)
+    nxt[ends[nonempty] - 1] = firsts[nonempty]
+    x, y = coords[:, 0], coords[:, 1]
+    cross = x * y[nxt] - x[nxt] * y
+    areas[nonempty] = np.add.reduceat(cross, firsts[nonempty])
+    return areas
+
+
+def close_ring(coords: np.ndarray, is_open: bool = None) -> np.ndarray:
+    """Return the ring with its first vertex repeated at the end if it is open."""
+    if is_open is None:
+        is_open = not (coords[0, 0] == coords[-1, 0] and coords[0, 1] == coords[-1, 1])
+    if not is_open:
+        return coords
+    return np.vstack((coords, coords[:1]))
+
+
+def orient_ring(coords: np.ndarray, ccw: bool, is_ccw: bool = None) -> np.ndarray:
+    """Return the ring wound counter-clockwise (ccw=True) or clockwise, per RFC 7946."""
+    if is_ccw is None:
+        is_ccw = ring_signed_areas(coords, np.array([0, len(coords)]))[0] > 0
+    if is_ccw == ccw:
+        return coords
+    return np.ascontiguousarray(coords[::-1])
+
+
+def intersects_aoi(coords: np.ndarray, aoi, closed: bool = False) -> bool:
+    """Check whether a feature touches the AOI polygon (always True without an AOI)."""
+    if aoi is None:
+        return True
+    # Cheap test first: any vertex inside the AOI
+    if shapely.intersects_xy(aoi, coords[:, 0], coords[:, 1]).any():
+        return True
+    # Otherwise the feature may still cross or enclose the AOI
+    if closed and len(coords) >= 4:
+        return aoi.intersects(shapely.polygons(coords))
+    return len(coords) >= 2 and aoi.intersects(shapely.linestrings(coords))
+
+
+def classify_feature(element_type: str, tags: dict) -> list[str]:
+    """Return the output layers a tagged Overpass element belongs to."""
+    layers = []
+    if element_type == "node":
+        if tags.get("man_made") == "wind_turbine" or (
+            tags.get("power") == "generator" and tags.get("generator:source") == "wind"
+        ):
+            layers.append("building")
+        return layers
+
+    if "building" in tags:
+        layers.append("building")
+    if element_type == "relation":
+        if tags.get("natural") == "water":
+            layers.append("water")
+        return layers
+
+    if "highway" in tags:
+        layers.append("road")
+    if tags.get("natural") == "water" or "waterway" in tags:
+        layers.append("water")
+    if tags.get("natural") == "coastline":
+        layers.append("coast")
+    if RAILWAY_PATTERN.search(tags.get("railway", "")):
+        layers.append("railway")
+    return layers
+
+
+def element_to_features(element: dict, feature_type: str, aoi=None,
+                        coords: np.ndarray = None, ring_open: bool = None,
+                        ring_ccw: bool = None) -> list[dict]:
+    """Convert a single Overpass element to GeoJSON features for one layer.
+
+    Features that do not touch the AOI polygon are rejected before their
+    GeoJSON is built. Polygon exteriors are wound counter-clockwise and holes
+    clockwise. For ways, pre-packed coordinates and the ring-open/ring-ccw
+    flags may be passed in (see pack_way_coords); otherwise they are derived
+    here.
     """
-    data = query_overpass(query)
-    return overpass_to_geojson(data, "coast")
-
-
-def fetch_railways(bbox: tuple) -> dict:
-    """Fetch railway lines."""
+    tags = dict(element.get("tags", {}))
+
+    # Handle point features (e.g., wind turbines)
+    if element["type"] == "node":
+        if aoi is not None and not shapely.intersects_xy(aoi, element["lon"], element["lat"]):
+            return []
+        tags["osm_id"] = element["id"]  # Add OSM ID
+        tags["osm_type"] = "node"
+        geometry = {
+            "type": "Point",
+            "coordinates": (element["lon"], element["lat"])
+        }
+        return [{
+            "type": "Feature",
+            "properties": tags,
+            "geometry": geometry
+        }]
+
+    if element["type"] == "way" and "geometry" in element:
+        if coords is None:
+            coords = way_coords(element["geometry"])
+        if len(coords) < 2:
+            return []
+
+        # Determine geometry type based on feature
+        if feature_type == "water":
+            # Linear waterways (streams, rivers) stay as LineStrings
+            # Area water bodies (ponds, lakes) become Polygons
+            if is_linear_waterway(tags):
+                geom_type = "LineString"
+            else:
+                geom_type = "Polygon"
+                coords = orient_ring(close_ring(coords, ring_open), ccw=True, is_ccw=ring_ccw)
+        elif feature_type == "building":
+            geom_type = "Polygon"
+            coords = orient_ring(close_ring(coords, ring_open), ccw=True, is_ccw=ring_ccw)
+        else:
+            geom_type = "LineString"
+
+        if not intersects_aoi(coords, aoi, closed=geom_type == "Polygon"):
+            return []
+
+        # Coordinates stay as ndarrays; save_layers serialises them directly
+        geometry = {
+            "type": geom_type,
+            "coordinates": [coords] if geom_type == "Polygon" else coords
+        }
+
+        tags["osm_id"] = element["id"]  # Add OSM ID
+        tags["osm_type"] = "way"
+        return [{
+            "type": "Feature",
+            "properties": tags,
+            "geometry": geometry
+        }]
+
+    if element["type"] == "relation" and "members" in element:
+        # Handle multipolygon relations
+        outer_rings = []
+        inner_rings = []
+
+        for member in element["members"]:
+            if member["type"] == "way" and "geometry" in member:
+                coords = way_coords(member["geometry"])
+                if len(coords) < 2:
+                    continue
+                is_inner = member.get("role") == "inner"
+                coords = orient_ring(close_ring(coords), ccw=not is_inner)
+                if not is_inner and not intersects_aoi(coords, aoi, closed=True):
+                    continue
+                if is_inner:
+                    inner_rings.append(coords)
+                else:
+                    outer_rings.append(coords)
+
+        # Create polygon(s) from outer rings
+        # For simplicity, treat each outer ring as separate polygon
+        tags["osm_id"] = element["id"]  # Add OSM ID
+        tags["osm_type"] = "relation"
+        features = []
+        for outer in outer_rings:
+            if len(outer) >= 4:  # Valid polygon needs at least 4 points
+                geometry = {
+                    "type": "Polygon",
+                    "coordinates": [outer] + inner_rings
+                }
+                features.append({
+                    "type": "Feature",
+                    "properties": tags.copy(),  # Copy to avoid sharing between polygons
+                    "geometry": geometry
+                })
+        return features
+
+    return []
+
+
+def overpass_to_geojson(data: dict, aoi=None) -> Iterator[tuple[str, dict]]:
+    """Convert Overpass JSON to GeoJSON features, yielding (layer, feature) pairs.
+
+    If an AOI polygon is given, features outside it are dropped.
+    """
+    elements = data.get("elements", [])
+
+    # Ways and relation members carry inline geometry (`out geom`), so no node
+    # join is needed. Tagged way geometries are packed into one array so ring
+    # closure and winding are checked for all of them at once.
+    ways = [e for e in elements if e["type"] == "way" and e.get("tags") and "geometry" in e]
+    way_slots = {way["id"]: i for i, way in enumerate(ways)}
+    coords, offsets = pack_way_coords(ways)
+    open_rings = open_ring_mask(coords, offsets)
+    ccw_rings = ring_signed_areas(coords, offsets) > 0
+
+    for element in elements:
+        tags = element.get("tags")
+        if not tags:
+            continue
+        way_coords_slice = ring_open = ring_ccw = None
+        slot = way_slots.get(element["id"]) if element["type"] == "way" else None
+        if slot is not None:
+            way_coords_slice = coords[offsets[slot]:offsets[slot + 1]]
+            ring_open = bool(open_rings[slot])
+            ring_ccw = bool(ccw_rings[slot])
+        for layer in classify_feature(element["type"], tags):
+            for feature in element_to_features(element, layer, aoi, way_coords_slice,
+                                               ring_open, ring_ccw):
+                yield layer, feature
+
+
+def build_query(bbox: tuple) -> str:
+    """Build a single compound Overpass query covering every output layer."""
     south, west, north, east = bbox
-    query = f"""
-    [out:json][timeout:180];
+    b = f"{south},{west},{north},{east}"
+    return f"""
+    [out:json][timeout:300];
     (
-      way["railway"~"rail|light_rail|tram|subway|narrow_gauge"]({south},{west},{north},{east});
+      way["building"]({b});
+      relation["building"]({b});
+      node["man_made"="wind_turbine"]({b});
+      node["power"="generator"]["generator:source"="wind"]({b});
+      way["highway"]({b});
+      way["natural"="water"]({b});
+      way["waterway"]({b});
+      relation["natural"="water"]({b});
+      way["natural"="coastline"]({b});
+      way["railway"~"{RAILWAY_PATTERN.pattern}"]({b});
     );
-    out body;
-    >;
-    out skel qt;
+    out geom qt;
     """
-    data = query_overpass(query)
-    return overpass_to_geojson(data, "railway")
 
 
-def save_geojson(data: dict, filepath: Path):
-    """Save GeoJSON to file."""
-    with open(filepath, "w") as f:
-        json.dump(data, f)
-    print(f"  Written: {filepath} ({len(data['features'])} features)")
+def fetch_all(bbox: tuple, aoi=None,
+              max_cache_age_s: float = OVERPASS_CACHE_MAX_AGE_S) -> Iterator[tuple[str, dict]]:
+    """Fetch buildings, roads, water, coastline and railways in one request."""
+    data = query_overpass(build_query(bbox), timeout=300, max_cache_age_s=max_cache_age_s)
+    return overpass_to_geojson(data, aoi)
 
 
-def main(twin_id: str = None):
+def save_layers(features: Iterable[tuple[str, dict]], output_dir: Path) -> dict[str, int]:
+    """Stream (layer, feature) pairs into one GeoJSON FeatureCollection file per layer.
+
+    Features are written as they are produced, so no layer is ever held in
+    memory as a whole. Returns the feature count per layer.
+    """
+    counts = {layer: 0 for layer in LAYERS}
+    with ExitStack() as stack:
+        files = {
+            layer: stack.enter_context(open(output_dir / LAYER_FILES[layer], "wb"))
+            for layer in LAYERS
+        }
+        for f in files.values():
+            f.write(b'{"type":"FeatureCollection","features":[')
+
+        for layer, feature in features:
+            f = files[layer]
+            if counts[layer]:
+                f.write(b",")
+            f.write(orjson.dumps(feature, option=orjson.OPT_SERIALIZE_NUMPY))
+            counts[layer] += 1
+
+        for f in files.values():
+            f.write(b"]}")
+
+    for layer in LAYERS:
+        print(f"  Written: {output_dir / LAYER_FILES[layer]} ({counts[layer]} features)")
+    return counts
+
+
+def main(twin_id: str = None, refresh: bool = False):
     """Fetch all OSM data."""
     if twin_id:
         print(f"Twin mode: {twin_id}")
         get_twin_paths(twin_id)
 
     print("Loading AOI...")
-    bbox = load_aoi_bbox_wgs84()
+    aoi = load_aoi_wgs84()
+    bbox = overpass_bbox(aoi)
     print(f"Bounding box (WGS84): S={bbox[0]:.4f}, W={bbox[1]:.4f}, N={bbox[2]:.4f}, E={bbox[3]:.4f}")
 
     _osm_dir.mkdir(parents=True, exist_ok=True)
 
-    # Fetch each dataset with delays to be nice to Overpass
-    print("\nFetching buildings...")
-    buildings = fetch_buildings(bbox)
-    save_geojson(buildings, _osm_dir / "buildings.geojson")
-    time.sleep(2)
-
-    print("\nFetching roads...")
-    roads = fetch_roads(bbox)
-    save_geojson(roads, _osm_dir / "roads.geojson")
-    time.sleep(2)
-
-    print("\nFetching water...")
-    water = fetch_water(bbox)
-    save_geojson(water, _osm_dir / "water.geojson")
-    time.sleep(2)
-
-    print("\nFetching coastline...")
-    coast = fetch_coastline(bbox)
-    save_geojson(coast, _osm_dir / "coast.geojson")
-    time.sleep(2)
-
-    print("\nFetching railways...")
-    railways = fetch_railways(bbox)
-    save_geojson(railways, _osm_dir / "railways.geojson")
+    # One compound query: a single round-trip and server-side bbox scan
+    print("\nFetching buildings, roads, water, coastline and railways...")
+    features = fetch_all(bbox, aoi, max_cache_age_s=0 if refresh else OVERPASS_CACHE_MAX_AGE_S)
+    counts = save_layers(features, _osm_dir)
 
     print("\nDone!")
     print(f"\nSummary:")
-    print(f"  Buildings: {len(buildings['features'])}")
-    print(f"  Roads: {len(roads['features'])}")
-    print(f"  Water: {len(water['features'])}")
-    print(f"  Coastline: {len(coast['features'])}")
-    print(f"  Railways: {len(railways['features'])}")
+    print(f"  Buildings: {counts['building']}")
+    print(f"  Roads: {counts['road']}")
+    print(f"  Water: {counts['water']}")
+    print(f"  Coastline: {counts['coast']}")
+    print(f"  Railways: {counts['railway']}")
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Fetch OSM data")
     parser.add_argument("--twin-id", help="Twin UUID for twin-specific execution")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Ignore cached Overpass responses and re-download")
     args = parser.parse_args()
-    main(args.twin_id)
+    main(args.twin_id, refresh=args.refresh)
@@ -18,16 +18,20 @@ Output:
 Usage:
     python 22_enrich_buildings.py
     python 22_enrich_buildings.py --twin-id <uuid>
+    python 22_enrich_buildings.py --explain   # Show the POI match query plan
 """
 
 import argparse
-import json
+import csv
+import io
 import os
 import sys
 import time
 from pathlib import Path
 
 import httpx
+import numpy as np
+import orjson
 import psycopg2
 from pyproj import Transformer
 
@@ -41,9 +45,18 @@ _twin_id = None
 
 # Coordinate transformers
 WGS84_TO_BNG = Transformer.from_crs("EPSG:4326", "EPSG:27700", always_xy=True)
+BNG_TO_WGS84 = Transformer.from_crs("EPSG:27700", "EPSG:4326", always_xy=True)
 
 OVERPASS_URL = "https://overpass-api.de/api/interpreter"
 
+# Shared HTTP/2 client so every Overpass call reuses one pooled TLS connection
+OVERPASS_CLIENT = httpx.Client(
+    http2=True,
+    timeout=180,
+    limits=httpx.Limits(max_connections=10, max_keepalive_connections=5),
+    headers={"User-Agent": "BlythTwin/1.0"},
+)
+
 # Maximum distance (meters) to match a POI node to a building
 MAX_MATCH_DISTANCE_M = 15.0
 
@@ -87,25 +100,32 @@ def get_connection():
 def load_aoi_bbox_wgs84() -> tuple[float, float, float, float]:
     """Load AOI and return bounding box in WGS84 (south, west, north, east)."""
     from shapely.geometry import shape
-    from shapely.ops import transform
 
     aoi_file = _config_dir / "aoi.geojson"
-    with open(aoi_file) as f:
-        aoi = json.load(f)
+    bbox_file = _config_dir / "aoi_bbox.json"
 
-    geom = shape(aoi["features"][0]["geometry"])
+    # Reuse the bbox computed on a previous run unless the AOI has changed since
+    if bbox_file.exists() and bbox_file.stat().st_mtime >= aoi_file.stat().st_mtime:
+        return tuple(orjson.loads(bbox_file.read_bytes()))
+
+    aoi = orjson.loads(aoi_file.read_bytes())
 
-    # Transform from BNG to WGS84
-    transformer = Transformer.from_crs("EPSG:27700", "EPSG:4326", always_xy=True)
-    geom_wgs84 = transform(transformer.transform, geom)
+    geom = shape(aoi["features"][0]["geometry"])
 
-    bounds = geom_wgs84.bounds  # (minx, miny, maxx, maxy)
+    # Transform only the BNG bounds (edges densified) in one PROJ call
+    bounds = BNG_TO_WGS84.transform_bounds(*geom.bounds, densify_pts=21)  # (minx, miny, maxx, maxy)
     # Overpass wants (south, west, north, east)
-    return (bounds[1], bounds[0], bounds[3], bounds[2])
+    bbox = (bounds[1], bounds[0], bounds[3], bounds[2])
+    bbox_file.write_bytes(orjson.dumps(bbox))
+    return bbox
 
 
 def fetch_poi_nodes(bbox: tuple) -> list[dict]:
-    """Fetch POI nodes from Overpass API."""
+    """Fetch POI nodes from Overpass API.
+
+    Every query in POI_QUERIES selects tagged nodes only, so the Overpass
+    elements (id, lat, lon, tags) are returned as-is without a per-element copy.
+    """
     south, west, north, east = bbox
 
     # Build query for all POI types
@@ -119,30 +139,87 @@ def fetch_poi_nodes(bbox: tuple) -> list[dict]:
     (
       {poi_filters}
     );
-    out body;
+    out body qt;
     """
 
     print(f"  Querying Overpass API for POI nodes...")
-    with httpx.Client(timeout=180) as client:
-        response = client.post(OVERPASS_URL, data={"data": query})
-        response.raise_for_status()
-        data = response.json()
-
-    nodes = []
-    for element in data.get("elements", []):
-        if element["type"] == "node" and element.get("tags"):
-            nodes.append({
-                "osm_id": element["id"],
-                "lat": element["lat"],
-                "lon": element["lon"],
-                "tags": element["tags"]
-            })
-
-    return nodes
-
-
-def match_and_enrich_buildings(conn, poi_nodes: list[dict]) -> dict:
-    """Match POI nodes to nearby buildings and enrich building data."""
+    response = OVERPASS_CLIENT.post(OVERPASS_URL, data={"data": query})
+    response.raise_for_status()
+    return orjson.loads(response.content).get("elements", [])
+
+
+# Nearest building within threshold for every POI: one GiST KNN descent per
+# POI inside a single statement, with each POI point built only once
+POI_MATCH_QUERY = """
+    WITH p AS MATERIALIZED (
+        SELECT seq, tags, ST_SetSRID(ST_MakePoint(x, y), 27700) AS g
+        FROM poi_stage
+    )
+    SELECT p.seq, p.tags, b.osm_id AS building_osm_id, b.distance
+    FROM p
+    CROSS JOIN LATERAL (
+        SELECT osm_id, ST_Distance(centroid, p.g) AS distance
+        FROM buildings
+        WHERE ST_DWithin(centroid, p.g, %s)
+        ORDER BY centroid <-> p.g
+        LIMIT 1
+    ) b
+"""
+
+
+def check_spatial_index(conn):
+    """Warn if buildings.centroid has no GiST index (the KNN match would scan every row)."""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT indexname FROM pg_indexes
+        WHERE tablename = 'buildings' AND indexdef ILIKE '%USING gist (centroid)%'
+    """)
+    if cur.fetchone() is None:
+        print("  Warning: no GiST index on buildings.centroid; POI matching will be slow.")
+        print("  Run schema/migrations/005_add_buildings_centroid_index.sql")
+    cur.close()
+
+
+def stage_poi_nodes(cur, poi_nodes: list[dict]):
+    """Load POI nodes (in BNG) into a temporary poi_stage table."""
+    cur.execute("""
+        CREATE TEMP TABLE poi_stage (
+            seq INTEGER PRIMARY KEY,
+            osm_id BIGINT,
+            x DOUBLE PRECISION,
+            y DOUBLE PRECISION,
+            tags JSONB
+        ) ON COMMIT DROP
+    """)
+
+    # Transform all POIs to BNG in one PROJ call
+    lons = np.fromiter((poi["lon"] for poi in poi_nodes), dtype=np.float64, count=len(poi_nodes))
+    lats = np.fromiter((poi["lat"] for poi in poi_nodes), dtype=np.float64, count=len(poi_nodes))
+    xs, ys = WGS84_TO_BNG.transform(lons, lats)
+
+    # Bulk-load through COPY rather than parameterised INSERTs
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for seq, (poi, x, y) in enumerate(zip(poi_nodes, xs.tolist(), ys.tolist())):
+        writer.writerow((seq, poi["id"], x, y, orjson.dumps(poi["tags"]).decode()))
+    buf.seek(0)
+
+    cur.copy_expert(
+        "COPY poi_stage (seq, osm_id, x, y, tags) FROM STDIN WITH (FORMAT csv)",
+        buf,
+    )
+
+
+def match_and_enrich_buildings(conn, poi_nodes: list[dict], explain: bool = False) -> dict:
+    """Match POI nodes to nearby buildings and enrich building data.
+
+    POIs are staged in a temp table and matched to their nearest building in
+    one KNN join. Each building then gets a single UPDATE that only fills
+    NULL columns; where several POIs match one building, the first POI that
+    has a value wins. Office keeps the original per-POI rule: it is
+    overwritten by the last office POI seen while the building still had no
+    amenity. With explain=True the match query plan is printed.
+    """
     cur = conn.cursor()
 
     stats = {
@@ -155,109 +232,98 @@ def match_and_enrich_buildings(conn, poi_nodes: list[dict]) -> dict:
         "no_match": 0,
     }
 
-    for poi in poi_nodes:
-        # Transform POI coords to BNG
-        x, y = WGS84_TO_BNG.transform(poi["lon"], poi["lat"])
-        tags = poi["tags"]
-
-        # Find nearest building within threshold
-        cur.execute("""
-            SELECT osm_id, name, amenity, shop,
-                   addr_housenumber, addr_street, addr_postcode, addr_city,
-                   ST_Distance(centroid, ST_SetSRID(ST_MakePoint(%s, %s), 27700)) as distance
-            FROM buildings
-            WHERE ST_DWithin(centroid, ST_SetSRID(ST_MakePoint(%s, %s), 27700), %s)
-            ORDER BY centroid <-> ST_SetSRID(ST_MakePoint(%s, %s), 27700)
-            LIMIT 1
-        """, (x, y, x, y, MAX_MATCH_DISTANCE_M, x, y))
-
-        row = cur.fetchone()
-        if not row:
-            stats["no_match"] += 1
-            continue
-
-        building_osm_id = row[0]
-        existing_name = row[1]
-        existing_amenity = row[2]
-        existing_shop = row[3]
-        existing_housenumber = row[4]
-        existing_street = row[5]
-        existing_postcode = row[6]
-        existing_city = row[7]
-        distance = row[8]
-
-        stats["matched"] += 1
-
-        # Build update query - only update NULL fields
-        updates = []
-        params = []
-
-        # Name
-        poi_name = tags.get("name")
-        if poi_name and not existing_name:
-            updates.append("name = %s")
-            params.append(poi_name)
-            stats["updated_name"] += 1
-
-        # Amenity
-        poi_amenity = tags.get("amenity")
-        if poi_amenity and not existing_amenity:
-            updates.append("amenity = %s")
-            params.append(poi_amenity)
-            stats["updated_amenity"] += 1
-
-        # Shop
-        poi_shop = tags.get("shop")
-        if poi_shop and not existing_shop:
-            updates.append("shop = %s")
-            params.append(poi_shop)
-            stats["updated_shop"] += 1
-
-        # Office (store in amenity if amenity is empty)
-        poi_office = tags.get("office")
-        if poi_office and not existing_amenity and "amenity" not in [u.split(" =")[0] for u in updates]:
-            updates.append("office = %s")
-            params.append(poi_office)
-
-        # Address fields
-        addr_updated = False
-
-        poi_housenumber = tags.get("addr:housenumber")
-        if poi_housenumber and not existing_housenumber:
-            updates.append("addr_housenumber = %s")
-            params.append(poi_housenumber)
-            addr_updated = True
-
-        poi_street = tags.get("addr:street")
-        if poi_street and not existing_street:
-            updates.append("addr_street = %s")
-            params.append(poi_street)
-            addr_updated = True
-
-        poi_postcode = tags.get("addr:postcode")
-        if poi_postcode and not existing_postcode:
-            updates.append("addr_postcode = %s")
-            params.append(poi_postcode)
-            addr_updated = True
-
-        poi_city = tags.get("addr:city")
-        if poi_city and not existing_city:
-            updates.append("addr_city = %s")
-            params.append(poi_city)
-            addr_updated = True
-
-        if addr_updated:
-            stats["updated_address"] += 1
-
-        # Execute update if there are changes
-        if updates:
-            updates.append("updated_at = NOW()")
-            params.append(building_osm_id)
-
-            sql = f"UPDATE buildings SET {', '.join(updates)} WHERE osm_id = %s"
-            cur.execute(sql, params)
-
-            print(f"    Enriched building {building_osm_id} with POI '{poi_name or tags.get('amenity') or tags.get('shop')}' ({distance:.1f}m)")
+    stage_poi_nodes(cur, poi_nodes)
+
+    # Give the planner row estimates for the temp table and allow a parallel plan
+    cur.execute("ANALYZE poi_stage")
+    cur.execute("SET LOCAL max_parallel_workers_per_gather = 4")
+
+    # Nearest building within threshold for every POI
+    if explain:
+        cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + POI_MATCH_QUERY, (MAX_MATCH_DISTANCE_M,))
+        print("  POI match plan:")
+        for (line,) in cur.fetchall():
+            print(f"    {line}")
+    cur.execute("CREATE TEMP TABLE poi_match ON COMMIT DROP AS " + POI_MATCH_QUERY,
+                (MAX_MATCH_DISTANCE_M,))
+    stats["matched"] = cur.rowcount
+    stats["no_match"] = stats["total_pois"] - stats["matched"]
+
+    # Only update NULL fields. Office replays the POI-by-POI rule: office POIs
+    # ahead of the first amenity POI (by seq) overwrite it, the last one
+    # winning, while the building has no amenity. Buildings that have nothing
+    # left to fill are dropped before aggregation (index-only with
+    # idx_buildings_enrichment).
+    cur.execute("""
+        WITH poi_values AS (
+            SELECT building_osm_id,
+                   MIN(distance) AS distance,
+                   (array_agg(tags->>'name' ORDER BY seq) FILTER (WHERE tags ? 'name'))[1] AS name,
+                   (array_agg(tags->>'amenity' ORDER BY seq) FILTER (WHERE tags ? 'amenity'))[1] AS amenity,
+                   (array_agg(tags->>'shop' ORDER BY seq) FILTER (WHERE tags ? 'shop'))[1] AS shop,
+                   (array_agg(tags->>'office' ORDER BY seq DESC) FILTER (
+                       WHERE tags ? 'office'
+                         AND (first_amenity_seq IS NULL OR seq < first_amenity_seq)
+                   ))[1] AS office,
+                   (array_agg(tags->>'addr:housenumber' ORDER BY seq) FILTER (WHERE tags ? 'addr:housenumber'))[1] AS addr_housenumber,
+                   (array_agg(tags->>'addr:street' ORDER BY seq) FILTER (WHERE tags ? 'addr:street'))[1] AS addr_street,
+                   (array_agg(tags->>'addr:postcode' ORDER BY seq) FILTER (WHERE tags ? 'addr:postcode'))[1] AS addr_postcode,
+                   (array_agg(tags->>'addr:city' ORDER BY seq) FILTER (WHERE tags ? 'addr:city'))[1] AS addr_city
+            FROM (
+                SELECT pm.*,
+                       MIN(seq) FILTER (WHERE tags ? 'amenity')
+                           OVER (PARTITION BY building_osm_id) AS first_amenity_seq
+                FROM poi_match pm
+            ) m
+            WHERE EXISTS (
+                SELECT 1 FROM buildings b
+                WHERE b.osm_id = m.building_osm_id
+                  AND (b.name IS NULL OR b.amenity IS NULL OR b.shop IS NULL
+                       OR b.addr_housenumber IS NULL OR b.addr_street IS NULL
+                       OR b.addr_postcode IS NULL OR b.addr_city IS NULL)
+            )
+            GROUP BY building_osm_id
+        ),
+        changes AS (
+            SELECT v.*,
+                   b.name IS NULL AND v.name IS NOT NULL AS fill_name,
+                   b.amenity IS NULL AND v.amenity IS NOT NULL AS fill_amenity,
+                   b.shop IS NULL AND v.shop IS NOT NULL AS fill_shop,
+                   b.amenity IS NULL AND v.office IS NOT NULL AS fill_office,
+                   (b.addr_housenumber IS NULL AND v.addr_housenumber IS NOT NULL)
+                       OR (b.addr_street IS NULL AND v.addr_street IS NOT NULL)
+                       OR (b.addr_postcode IS NULL AND v.addr_postcode IS NOT NULL)
+                       OR (b.addr_city IS NULL AND v.addr_city IS NOT NULL) AS fill_address
+            FROM poi_values v
+            JOIN buildings b ON b.osm_id = v.building_osm_id
+        )
+        UPDATE buildings b SET
+            name = COALESCE(b.name, c.name),
+            amenity = COALESCE(b.amenity, c.amenity),
+            shop = COALESCE(b.shop, c.shop),
+            office = CASE WHEN c.fill_office THEN c.office ELSE b.office END,
+            addr_housenumber = COALESCE(b.addr_housenumber, c.addr_housenumber),
+            addr_street = COALESCE(b.addr_street, c.addr_street),
+            addr_postcode = COALESCE(b.addr_postcode, c.addr_postcode),
+            addr_city = COALESCE(b.addr_city, c.addr_city),
+            updated_at = NOW()
+        FROM changes c
+        WHERE b.osm_id = c.building_osm_id
+          AND (c.fill_name OR c.fill_amenity OR c.fill_shop OR c.fill_office OR c.fill_address)
+        RETURNING b.osm_id, COALESCE(c.name, c.amenity, c.shop), c.distance,
+                  c.fill_name, c.fill_amenity, c.fill_shop, c.fill_address
+    """)
+
+    # Collect the per-building log lines and write them in one go
+    log_lines = []
+    for building_osm_id, label, distance, fill_name, fill_amenity, fill_shop, fill_address in cur.fetchall():
+        stats["updated_name"] += fill_name
+        stats["updated_amenity"] += fill_amenity
+        stats["updated_shop"] += fill_shop
+        stats["updated_address"] += fill_address
+        log_lines.append(f"    Enriched building {building_osm_id} with POI '{label}' ({distance:.1f}m)\n")
+    sys.stdout.writelines(log_lines)
+    sys.stdout.flush()
 
     conn.commit()
     cur.close()
@@ -308,7 +374,7 @@ def print_enrichment_stats(conn):
     cur.close()
 
 
-def main(twin_id: str = None):
+def main(twin_id: str = None, explain: bool = False):
     """Enrich buildings with POI data from OSM."""
     if twin_id:
         print(f"Twin mode: {twin_id}")
@@ -339,7 +405,8 @@ def main(twin_id: str = None):
 
     print("\nMatching POIs to buildings...")
     conn = get_connection()
-    stats = match_and_enrich_buildings(conn, poi_nodes)
+    check_spatial_index(conn)
+    stats = match_and_enrich_buildings(conn, poi_nodes, explain=explain)
 
     print("\n" + "-" * 50)
     print("MATCHING RESULTS")
@@ -361,5 +428,7 @@ def main(twin_id: str = None):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Enrich buildings with OSM POI data")
     parser.add_argument("--twin-id", help="Twin UUID for twin-specific execution")
+    parser.add_argument("--explain", action="store_true",
+                        help="Print the EXPLAIN (ANALYZE, BUFFERS) plan of the POI match query")
     args = parser.parse_args()
-    main(args.twin_id)
+    main(args.twin_id, explain=args.explain)
@@ -26,14 +26,18 @@ Note: OS Open UPRN is downloaded from OS Data Hub (free registration required)
       https://osdatahub.os.uk/downloads/open/OpenUPRN
 """
 
-import json
+import asyncio
 import os
+import shelve
 import zipfile
 from pathlib import Path
 from io import BytesIO
 
-import requests
+import httpx
+import orjson
+import shapely
 from pyproj import Transformer
+from shapely.geometry import shape
 
 # Paths
 SCRIPT_DIR = Path(__file__).parent
@@ -41,6 +45,12 @@ CONFIG_DIR = SCRIPT_DIR.parent / "config"
 DATA_DIR = SCRIPT_DIR.parent.parent / "data"
 RAW_DIR = DATA_DIR / "raw"
 PROCESSED_DIR = DATA_DIR / "processed"
+GEOCODE_CACHE_PATH = DATA_DIR / "cache" / "nominatim_reverse"
+
+# Reverse geocode results are cached per coordinate rounded to this many
+# decimal places (5 dp is roughly 1m), fine enough to keep house numbers apart
+# (4 dp, ~11m x 6m here, merged neighbouring terraced houses)
+GEOCODE_CACHE_PRECISION = 5
 
 # Coordinate transformer
 BNG_TO_WGS84 = Transformer.from_crs("EPSG:27700", "EPSG:4326", always_xy=True)
@@ -50,11 +60,23 @@ WGS84_TO_BNG = Transformer.from_crs("EPSG:4326", "EPSG:27700", always_xy=True)
 # The full dataset is ~2GB, so we'll need to filter by area
 UPRN_DOWNLOAD_URL = "https://api.os.uk/downloads/v1/products/OpenUPRN/downloads"
 
+NOMINATIM_REVERSE_URL = "https://nominatim.openstreetmap.org/reverse"
+NOMINATIM_HEADERS = {
+    "User-Agent": "BlythDigitalTwin/1.0 (building address lookup)"
+}
+PHOTON_REVERSE_URL = "https://photon.komoot.io/reverse"
+
+# Seconds an endpoint backs off after answering 429 Too Many Requests
+RATE_LIMIT_BACKOFF_S = 30.0
+
+# Flush the geocode cache to disk every this many lookups, so an interrupted
+# run resumes from the cache instead of starting over
+GEOCODE_CHECKPOINT_EVERY = 500
+
 
 def load_aoi_bounds():
     """Load AOI bounds in BNG coordinates."""
-    with open(CONFIG_DIR / "aoi.geojson") as f:
-        aoi = json.load(f)
+    aoi = orjson.loads((CONFIG_DIR / "aoi.geojson").read_bytes())
 
     props = aoi["features"][0]["properties"]
     centre = props["centre_bng"]
@@ -98,29 +120,166 @@ def download_uprn_csv(output_dir: Path) -> Path | None:
     return None
 
 
-def reverse_geocode_nominatim(lat: float, lon: float) -> dict | None:
+class RequestGate:
+    """Spaces request start times at least `interval` seconds apart."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = asyncio.Lock()
+        self._next_start = 0.0
+
+    async def wait(self):
+        """Wait until the next request slot is available."""
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            if self._next_start > now:
+                await asyncio.sleep(self._next_start - now)
+                now = self._next_start
+            self._next_start = now + self.interval
+
+
+def reverse_geocode_endpoints() -> list[tuple[str, str]]:
     """
-    Reverse geocode a coordinate using Nominatim (free, rate-limited).
+    List the (kind, url) reverse geocoders that lookups are sharded across.
+
+    Extra self-hosted Nominatim instances can be added as a comma-separated
+    list of reverse URLs in NOMINATIM_MIRRORS.
     """
-    url = "https://nominatim.openstreetmap.org/reverse"
-    params = {
-        "lat": lat,
-        "lon": lon,
-        "format": "jsonv2",
-        "addressdetails": 1
-    }
-    headers = {
-        "User-Agent": "BlythDigitalTwin/1.0 (building address lookup)"
+    endpoints = [("nominatim", NOMINATIM_REVERSE_URL), ("photon", PHOTON_REVERSE_URL)]
+    mirrors = os.environ.get("NOMINATIM_MIRRORS", "")
+    endpoints += [("nominatim", url.strip()) for url in mirrors.split(",") if url.strip()]
+    # One worker per distinct URL (first listing wins)
+    unique = {}
+    for kind, url in endpoints:
+        unique.setdefault(url, (kind, url))
+    return list(unique.values())
+
+
+def photon_to_nominatim(data: dict) -> dict | None:
+    """Reshape a Photon reverse response into Nominatim's address layout."""
+    features = data.get("features") or []
+    if not features:
+        return None
+
+    props = features[0].get("properties", {})
+    address = {
+        "house_number": props.get("housenumber"),
+        "road": props.get("street"),
+        "postcode": props.get("postcode"),
+        "city": props.get("city"),
+        "suburb": props.get("district"),
     }
+    return {"address": {k: v for k, v in address.items() if v}}
+
+
+async def reverse_geocode(client: httpx.AsyncClient, gate: RequestGate, kind: str,
+                          url: str, lat: float, lon: float) -> tuple[dict | None, bool]:
+    """
+    Reverse geocode a coordinate using a Nominatim or Photon endpoint.
 
+    Returns (result in Nominatim layout or None, whether the endpoint
+    answered 429).
+    """
+    if kind == "photon":
+        params = {"lat": lat, "lon": lon}
+    else:
+        params = {
+            "lat": lat,
+            "lon": lon,
+            "format": "jsonv2",
+            "addressdetails": 1
+        }
+
+    await gate.wait()
     try:
-        resp = requests.get(url, params=params, headers=headers, timeout=10)
+        resp = await client.get(url, params=params)
+        if resp.status_code == 429:
+            return None, True
         if resp.status_code == 200:
-            return resp.json()
-    except Exception as e:
+            data = orjson.loads(resp.content)
+            return (photon_to_nominatim(data) if kind == "photon" else data), False
+    except Exception:
         pass
 
-    return None
+    return None, False
+
+
+async def fetch_reverse_geocodes(points: dict[str, tuple[float, float]], cache,
+                                 delay: float = 1.0) -> dict[str, dict | None]:
+    """
+    Reverse geocode (lat, lon) points keyed by cache key, caching successes.
+
+    Points are pulled from a shared queue by one worker per endpoint, each
+    spacing its own request starts `delay` seconds apart, so throughput
+    scales with the number of endpoints while every host sees its fair-use
+    rate. A point rate-limited by one endpoint is handed to the inbox of an
+    endpoint it hasn't tried yet; workers stay up until every point is
+    settled, then stop on a sentinel.
+    """
+    endpoints = reverse_geocode_endpoints()
+    queue = asyncio.Queue()
+    for key in points:
+        queue.put_nowait(key)
+    inboxes = {url: asyncio.Queue() for _, url in endpoints}
+    tried = {}
+    results = {}
+
+    def settle(key: str, result: dict | None):
+        if result:
+            cache[key] = result
+        results[key] = result
+        if len(results) % 50 == 0:
+            print(f"  Fetched {len(results)}/{len(points)}")
+        if len(results) % GEOCODE_CHECKPOINT_EVERY == 0:
+            cache.sync()
+        if len(results) == len(points):
+            for inbox in inboxes.values():
+                inbox.put_nowait(None)
+
+    async def worker(kind: str, url: str):
+        inbox = inboxes[url]
+        gate = RequestGate(delay)
+        async with httpx.AsyncClient(
+            http2=True,
+            timeout=10,
+            limits=httpx.Limits(max_connections=1),
+            headers=NOMINATIM_HEADERS,
+        ) as client:
+            while True:
+                # Handed-off points first, then fresh ones; once the shared
+                # queue is drained, wait for a handoff or the stop sentinel
+                if not inbox.empty():
+                    key = inbox.get_nowait()
+                elif not queue.empty():
+                    key = queue.get_nowait()
+                else:
+                    key = await inbox.get()
+                if key is None:
+                    break
+
+                lat, lon = points[key]
+                result, rate_limited = await reverse_geocode(client, gate, kind, url, lat, lon)
+
+                if rate_limited:
+                    tried.setdefault(key, set()).add(url)
+                    untried = [other for other in inboxes if other not in tried[key]]
+                    if untried:
+                        target = min(untried, key=lambda other: inboxes[other].qsize())
+                        inboxes[target].put_nowait(key)
+                        await asyncio.sleep(RATE_LIMIT_BACKOFF_S)
+                        continue
+
+                settle(key, result)
+
+    if points:
+        await asyncio.gather(*(worker(kind, url) for kind, url in endpoints))
+
+    return results
+
+
+def geocode_cache_key(lat: float, lon: float) -> str:
+    """Cache key for a coordinate rounded to GEOCODE_CACHE_PRECISION."""
+    return f"{lat:.{GEOCODE_CACHE_PRECISION}f},{lon:.{GEOCODE_CACHE_PRECISION}f}"
 
 
 def extract_address_from_nominatim(data: dict) -> dict:
@@ -157,20 +316,39 @@ def extract_address_from_nominatim(data: dict) -> dict:
     return result
 
 
+def write_feature_collection(path: Path, data: dict):
+    """
+    Write a FeatureCollection one feature at a time instead of as one big buffer.
+
+    The file is written beside `path` and renamed into place, so an
+    interrupted write never leaves a truncated GeoJSON behind.
+    """
+    header = {key: value for key, value in data.items() if key != "features"}
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "wb") as f:
+        # Reuse the serialised header minus its closing brace, then append features
+        f.write(orjson.dumps(header)[:-1])
+        f.write(b',"features":[' if header else b'"features":[')
+        for i, feature in enumerate(data.get("features", [])):
+            if i:
+                f.write(b",")
+            f.write(orjson.dumps(feature))
+        f.write(b"]}")
+    os.replace(tmp_path, path)
+
+
 def batch_reverse_geocode(buildings_path: Path, output_path: Path,
                           max_requests: int = 1000, delay: float = 1.0):
     """
     Add addresses to buildings via reverse geocoding.
 
-    Note: Nominatim has a rate limit of 1 request/second.
-    For 17k buildings, this would take ~5 hours.
+    Note: Nominatim has a rate limit of 1 request/second per endpoint.
+    For 17k buildings, this would take ~5 hours on a single endpoint;
+    lookups are sharded across Nominatim, Photon and any NOMINATIM_MIRRORS.
     We'll prioritize buildings without addresses.
     """
-    import time
-
     print(f"Loading buildings from {buildings_path}...")
-    with open(buildings_path) as f:
-        data = json.load(f)
+    data = orjson.loads(buildings_path.read_bytes())
 
     features = data["features"]
     total = len(features)
@@ -197,53 +375,67 @@ def batch_reverse_geocode(buildings_path: Path, output_path: Path,
 
     # Limit requests
     to_process = needs_address[:max_requests]
-    print(f"Will geocode {len(to_process)} buildings (rate limited)")
-    print(f"Estimated time: {len(to_process) * delay / 60:.1f} minutes")
+    n_endpoints = len(reverse_geocode_endpoints())
+    print(f"Will geocode {len(to_process)} buildings (rate limited, {n_endpoints} endpoints)")
+    print(f"Estimated time: {len(to_process) * delay / n_endpoints / 60:.1f} minutes")
     print()
 
+    # Area-weighted footprint centroids, computed up front in GEOS
+    polygon_idxs = [i for i in to_process if (features[i].get("geometry") or {}).get("type") == "Polygon"]
+    centroid_points = shapely.centroid([shape(features[i]["geometry"]) for i in polygon_idxs])
+    centroids = dict(zip(
+        polygon_idxs,
+        zip(shapely.get_x(centroid_points).tolist(), shapely.get_y(centroid_points).tolist()),
+    ))
+
     success = 0
     failed = 0
 
-    for idx, feat_idx in enumerate(to_process):
-        feat = features[feat_idx]
-        geom = feat.get("geometry", {})
-
-        if geom.get("type") != "Polygon":
+    # Persistent cache so neighbouring buildings and re-runs reuse responses
+    GEOCODE_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with shelve.open(str(GEOCODE_CACHE_PATH)) as cache:
+        cache_keys = {
+            feat_idx: geocode_cache_key(lat, lon)
+            for feat_idx, (lon, lat) in centroids.items()
+        }
+        results = {key: cache[key] for key in set(cache_keys.values()) if key in cache}
+        cache_hits = sum(1 for key in cache_keys.values() if key in results)
+
+        # Only unique uncached points go to the geocoders
+        missing = {}
+        for feat_idx, key in cache_keys.items():
+            if key not in results and key not in missing:
+                lon, lat = centroids[feat_idx]
+                missing[key] = (lat, lon)
+
+        if missing:
+            print(f"Requesting {len(missing)} uncached points from the geocoders...")
+            results.update(asyncio.run(fetch_reverse_geocodes(missing, cache, delay)))
+
+    for feat_idx in to_process:
+        if feat_idx not in cache_keys:
             continue
 
-        # Get centroid
-        coords = geom["coordinates"][0]
-        lon = sum(c[0] for c in coords) / len(coords)
-        lat = sum(c[1] for c in coords) / len(coords)
-
-        # Reverse geocode
-        result = reverse_geocode_nominatim(lat, lon)
-
+        result = results.get(cache_keys[feat_idx])
         if result:
             addr = extract_address_from_nominatim(result)
             if addr:
                 # Update properties
-                feat["properties"].update(addr)
+                features[feat_idx]["properties"].update(addr)
                 success += 1
             else:
                 failed += 1
         else:
             failed += 1
 
-        # Progress
-        if (idx + 1) % 50 == 0:
-            print(f"  Processed {idx + 1}/{len(to_process)} - Success: {success}, Failed: {failed}")
-
-        # Rate limiting
-        time.sleep(delay)
-
     print()
     print(f"Geocoding complete: {success} addresses found, {failed} failed")
+    if cache_keys:
+        print(f"Cache hits: {cache_hits}/{len(cache_keys)} ({100 * cache_hits / len(cache_keys):.0f}%)")
 
     # Save updated data
     print(f"Saving to {output_path}...")
-    with open(output_path, "w") as f:
-        json.dump(data, f)
+    write_feature_collection(output_path, data)
 
     print("Done!")
 
@@ -270,7 +462,7 @@ def main():
     print("=" * 50)
     print()
     print("This will reverse geocode building centroids to find addresses.")
-    print("Nominatim is free but rate-limited to 1 request/second.")
+    print("Nominatim/Photon are free but rate-limited to 1 request/second each.")
     print()
 
     batch_reverse_geocode(
@@ -5,20 +5,39 @@
 Uses Nominatim to find house numbers and postcodes for buildings
 without address data. Updates PostGIS database directly.
 
+With --backend geoapify, lookups go to Geoapify's batch reverse geocoding
+endpoint instead (requires GEOAPIFY_API_KEY).
+
 Usage:
     python 26_geocode_addresses.py [--batch-size 1000] [--delay 1.1]
+    python 26_geocode_addresses.py --backend geoapify
 """
 
 import argparse
+import asyncio
 import os
+import shelve
 import sys
 import time
+from collections import defaultdict
 from datetime import datetime
+from pathlib import Path
 
+import httpx
+import orjson
 import psycopg2
-import requests
+from psycopg2.extras import execute_values
 from pyproj import Transformer
 
+# Paths
+SCRIPT_DIR = Path(__file__).parent
+DATA_DIR = SCRIPT_DIR.parent.parent / "data"
+GEOCODE_CACHE_PATH = DATA_DIR / "cache" / "nominatim_reverse_addresses"
+
+# Reverse geocode results are cached per coordinate rounded to this many
+# decimal places (5 dp is roughly 1m), fine enough to keep house numbers apart
+GEOCODE_CACHE_PRECISION = 5
+
 # Coordinate transformer (BNG to WGS84 for Nominatim)
 BNG_TO_WGS84 = Transformer.from_crs("EPSG:27700", "EPSG:4326", always_xy=True)
 
@@ -26,6 +45,21 @@ BNG_TO_WGS84 = Transformer.from_crs("EPSG:27700", "EPSG:4326", always_xy=True)
 NOMINATIM_URL = "https://nominatim.openstreetmap.org/reverse"
 USER_AGENT = "BlythDigitalTwin/1.0 (building address lookup)"
 
+# Geoapify batch settings (one job per GEOAPIFY_BATCH_SIZE coordinates)
+GEOAPIFY_BATCH_URL = "https://api.geoapify.com/v1/batch/geocode/reverse"
+GEOAPIFY_BATCH_SIZE = 1000
+GEOAPIFY_POLL_INTERVAL_S = 2.0
+GEOAPIFY_MAX_POLLS = 150  # ~5 minutes per job before giving up
+
+# Responses worth retrying; Retry-After is honoured, otherwise the backoff is
+# exponential starting at RETRY_BACKOFF_S
+RETRY_STATUSES = {429, 502, 503, 504}
+MAX_RETRIES = 5
+RETRY_BACKOFF_S = 1.5
+
+# Buffered address updates are written (and committed) every this many rows
+UPDATE_FLUSH_SIZE = 100
+
 
 def get_connection():
     """Get database connection."""
@@ -38,7 +72,47 @@ def get_connection():
     )
 
 
-def reverse_geocode(lat: float, lon: float) -> dict | None:
+class RequestGate:
+    """
+    Spaces request start times at least `interval` seconds apart.
+
+    Acts as a token bucket of capacity one: a caller only sleeps for the
+    residual time since the previous start.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = asyncio.Lock()
+        self._next_start = 0.0
+
+    async def wait(self):
+        """Wait until the next request slot is available."""
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            if self._next_start > now:
+                await asyncio.sleep(self._next_start - now)
+                now = self._next_start
+            self._next_start = now + self.interval
+
+    def defer(self, seconds: float):
+        """Hold back every caller's next request for at least `seconds`."""
+        resume = asyncio.get_running_loop().time() + seconds
+        self._next_start = max(self._next_start, resume)
+
+
+def retry_delay(resp: httpx.Response, attempt: int) -> float:
+    """Seconds to wait before retrying, from Retry-After or exponential backoff."""
+    retry_after = resp.headers.get("Retry-After")
+    if retry_after:
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            pass
+    return RETRY_BACKOFF_S * 2 ** attempt
+
+
+async def reverse_geocode(client: httpx.AsyncClient, gate: RequestGate,
+                          lat: float, lon: float) -> dict | None:
     """Reverse geocode a coordinate using Nominatim."""
     params = {
         "lat": lat,
@@ -46,18 +120,86 @@ def reverse_geocode(lat: float, lon: float) -> dict | None:
         "format": "jsonv2",
         "addressdetails": 1
     }
-    headers = {"User-Agent": USER_AGENT}
 
-    try:
-        resp = requests.get(NOMINATIM_URL, params=params, headers=headers, timeout=10)
-        if resp.status_code == 200:
-            return resp.json()
-    except Exception as e:
-        print(f"    Error: {e}")
+    for attempt in range(MAX_RETRIES + 1):
+        await gate.wait()
+        try:
+            resp = await client.get(NOMINATIM_URL, params=params)
+            if resp.status_code == 200:
+                return orjson.loads(resp.content)
+            if resp.status_code in RETRY_STATUSES and attempt < MAX_RETRIES:
+                # Pause the whole batch, not just this lookup, so a 429 is not
+                # answered with more requests from the other in-flight tasks
+                gate.defer(retry_delay(resp, attempt))
+                continue
+        except Exception as e:
+            print(f"    Error: {e}")
+        break
 
     return None
 
 
+def geoapify_to_nominatim(data: dict) -> dict | None:
+    """Reshape a Geoapify batch result into Nominatim's address layout."""
+    if not data or data.get("error"):
+        return None
+
+    address = {
+        "house_number": data.get("housenumber"),
+        "road": data.get("street"),
+        "postcode": data.get("postcode"),
+        "city": data.get("city"),
+        "suburb": data.get("suburb"),
+    }
+    return {"address": {k: v for k, v in address.items() if v}}
+
+
+async def batch_reverse_geoapify(client: httpx.AsyncClient, api_key: str,
+                                 coords: list[tuple[float, float]]) -> list[dict | None]:
+    """
+    Reverse geocode (lat, lon) coordinates with Geoapify's batch API.
+
+    Each chunk of GEOAPIFY_BATCH_SIZE coordinates is submitted as one job,
+    which is polled until its results are ready (TimeoutError after
+    GEOAPIFY_MAX_POLLS polls). Results come back in input order, in
+    Nominatim's address layout.
+    """
+    results = []
+    for i in range(0, len(coords), GEOAPIFY_BATCH_SIZE):
+        chunk = coords[i:i + GEOAPIFY_BATCH_SIZE]
+        resp = await client.post(
+            GEOAPIFY_BATCH_URL,
+            params={"apiKey": api_key, "format": "json"},
+            content=orjson.dumps([{"lat": lat, "lon": lon} for lat, lon in chunk]),
+            headers={"Content-Type": "application/json"},
+        )
+        resp.raise_for_status()
+        job_url = orjson.loads(resp.content)["url"]
+
+        # Poll the job until it stops answering 202 Accepted
+        for _ in range(GEOAPIFY_MAX_POLLS):
+            await asyncio.sleep(GEOAPIFY_POLL_INTERVAL_S)
+            resp = await client.get(job_url)
+            if resp.status_code != 202:
+                break
+        else:
+            raise TimeoutError(
+                f"Geoapify batch job {job_url} still pending after "
+                f"{GEOAPIFY_MAX_POLLS * GEOAPIFY_POLL_INTERVAL_S:.0f}s"
+            )
+        resp.raise_for_status()
+
+        results.extend(geoapify_to_nominatim(item) for item in orjson.loads(resp.content))
+        print(f"  Geoapify: {min(i + GEOAPIFY_BATCH_SIZE, len(coords))}/{len(coords)} coordinates")
+
+    return results
+
+
+def geocode_cache_key(lat: float, lon: float) -> str:
+    """Cache key for a coordinate rounded to GEOCODE_CACHE_PRECISION."""
+    return f"{lat:.{GEOCODE_CACHE_PRECISION}f},{lon:.{GEOCODE_CACHE_PRECISION}f}"
+
+
 def extract_address(data: dict) -> dict:
     """Extract house number and postcode from Nominatim response."""
     if not data:
@@ -101,37 +243,140 @@ def get_buildings_needing_addresses(conn, limit: int) -> list:
     return buildings
 
 
-def update_building_address(conn, building_id: int, address: dict):
-    """Update a building's address in the database."""
-    cur = conn.cursor()
-
-    updates = []
-    values = []
-
-    if address.get("housenumber"):
-        updates.append("addr_housenumber = %s")
-        values.append(address["housenumber"])
-
-    if address.get("postcode"):
-        updates.append("addr_postcode = %s")
-        values.append(address["postcode"])
-
-    if address.get("street") and not address.get("existing_street"):
-        updates.append("addr_street = COALESCE(addr_street, %s)")
-        values.append(address["street"])
+def update_building_addresses(conn, rows: list[tuple]):
+    """
+    Write buffered (building_id, housenumber, postcode, street) rows in one UPDATE.
 
-    if updates:
-        updates.append("updated_at = NOW()")
-        values.append(building_id)
-
-        sql = f"UPDATE buildings SET {', '.join(updates)} WHERE id = %s"
-        cur.execute(sql, values)
+    NULL values leave the existing column untouched; street is only filled
+    where the building has none.
+    """
+    if not rows:
+        return
 
+    cur = conn.cursor()
+    execute_values(cur, """
+        UPDATE buildings b SET
+            addr_housenumber = COALESCE(v.housenumber, b.addr_housenumber),
+            addr_postcode = COALESCE(v.postcode, b.addr_postcode),
+            addr_street = COALESCE(b.addr_street, v.street),
+            updated_at = NOW()
+        FROM (VALUES %s) AS v(id, housenumber, postcode, street)
+        WHERE b.id = v.id
+    """, rows, template="(%s, %s::text, %s::text, %s::text)", page_size=UPDATE_FLUSH_SIZE)
     cur.close()
-
-
-def run_batch(batch_size: int, delay: float):
+    conn.commit()
+
+
+async def _run_batch_async(conn, cache, buildings: list, delay: float, start_time: float,
+                           backend: str = "nominatim") -> dict:
+    """
+    Geocode and update a batch of buildings with overlapping requests.
+
+    Request starts are spaced `delay` seconds apart to respect Nominatim's
+    rate limit, but each round-trip runs while the next slot is awaited, so
+    a batch costs about max(latency, delay) per building rather than the sum.
+    Buildings whose centroids share a cache key are geocoded once and the
+    result is applied to all of them. Responses are kept in the persistent
+    `cache`, so re-runs and neighbouring buildings skip the request entirely.
+    With backend="geoapify" every uncached coordinate is resolved up front
+    through the batch API.
+    """
+    total = len(buildings)
+    stats = {"housenumber": 0, "postcode": 0, "failed": 0, "done": 0, "cache_hits": 0}
+    gate = RequestGate(delay)
+    pending_rows = []
+    # Flushes run in a worker thread so the event loop keeps issuing requests;
+    # the lock keeps them one at a time on the single connection
+    db_lock = asyncio.Lock()
+
+    async def flush_rows(rows: list[tuple]):
+        async with db_lock:
+            await asyncio.to_thread(update_building_addresses, conn, rows)
+
+    # Convert BNG to WGS84 and group building ids by rounded coordinate
+    lons, lats = BNG_TO_WGS84.transform(
+        [b[2] for b in buildings], [b[3] for b in buildings]
+    )
+    groups = defaultdict(list)
+    coords = {}
+    for (building_id, osm_id, x, y), lon, lat in zip(buildings, lons, lats):
+        key = geocode_cache_key(lat, lon)
+        groups[key].append(building_id)
+        coords.setdefault(key, (lat, lon))
+    if len(groups) < total:
+        print(f"  {total - len(groups)} buildings share a coordinate, {len(groups)} unique lookups")
+
+    async with httpx.AsyncClient(
+        http2=True,
+        timeout=10,
+        limits=httpx.Limits(max_connections=1),
+        headers={"User-Agent": USER_AGENT},
+    ) as client:
+        prefetched = {}
+        if backend == "geoapify":
+            missing = [key for key in groups if key not in cache]
+            if missing:
+                found = await batch_reverse_geoapify(
+                    client, os.environ["GEOAPIFY_API_KEY"], [coords[key] for key in missing]
+                )
+                prefetched = dict(zip(missing, found))
+
+        async def geocode_group(key: str, building_ids: list[int]):
+            lat, lon = coords[key]
+
+            # Reverse geocode, unless this coordinate has been looked up before
+            result = cache.get(key)
+            if result is not None:
+                stats["cache_hits"] += len(building_ids)
+            else:
+                if backend == "geoapify":
+                    result = prefetched.get(key)
+                else:
+                    result = await reverse_geocode(client, gate, lat, lon)
+                if result:
+                    cache[key] = result
+            address = extract_address(result)
+
+            for building_id in building_ids:
+                if address:
+                    street = None if address.get("existing_street") else address.get("street")
+                    pending_rows.append((building_id, address.get("housenumber"), address.get("postcode"), street))
+                    if len(pending_rows) >= UPDATE_FLUSH_SIZE:
+                        rows = pending_rows[:]
+                        pending_rows.clear()
+                        await flush_rows(rows)
+
+                    if address.get("housenumber"):
+                        stats["housenumber"] += 1
+                    if address.get("postcode"):
+                        stats["postcode"] += 1
+                else:
+                    stats["failed"] += 1
+
+                # Progress every 100
+                stats["done"] += 1
+                done = stats["done"]
+                if done % 100 == 0:
+                    elapsed = time.time() - start_time
+                    rate = done / elapsed
+                    remaining = (total - done) / rate if rate > 0 else 0
+                    print(f"  [{done}/{total}] House#: {stats['housenumber']}, Postcode: {stats['postcode']}, Failed: {stats['failed']} | {remaining/60:.1f}m remaining")
+
+        await asyncio.gather(*(
+            geocode_group(key, building_ids)
+            for key, building_ids in groups.items()
+        ))
+
+    await flush_rows(pending_rows)
+    return stats
+
+
+def run_batch(batch_size: int, delay: float, backend: str = "nominatim"):
     """Run a batch of geocoding requests."""
+    if backend == "geoapify" and not os.environ.get("GEOAPIFY_API_KEY"):
+        print("GEOAPIFY_API_KEY must be set to use the geoapify backend")
+        return
+
     conn = get_connection()
 
     print(f"\n{'='*60}")
@@ -139,6 +384,7 @@ def run_batch(batch_size: int, delay: float):
     print(f"{'='*60}")
     print(f"Started: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print(f"Batch size: {batch_size}")
+    print(f"Backend: {backend}")
     print(f"Delay: {delay}s between requests")
     print()
 
@@ -154,40 +400,15 @@ def run_batch(batch_size: int, delay: float):
     print(f"Processing {total} buildings...")
     print()
 
-    found_housenumber = 0
-    found_postcode = 0
-    failed = 0
-
     start_time = time.time()
 
-    for idx, (building_id, osm_id, x, y) in enumerate(buildings):
-        # Convert BNG to WGS84
-        lon, lat = BNG_TO_WGS84.transform(x, y)
-
-        # Reverse geocode
-        result = reverse_geocode(lat, lon)
-        address = extract_address(result)
-
-        if address:
-            update_building_address(conn, building_id, address)
-            conn.commit()
-
-            if address.get("housenumber"):
-                found_housenumber += 1
-            if address.get("postcode"):
-                found_postcode += 1
-        else:
-            failed += 1
-
-        # Progress every 100
-        if (idx + 1) % 100 == 0:
-            elapsed = time.time() - start_time
-            rate = (idx + 1) / elapsed
-            remaining = (total - idx - 1) / rate if rate > 0 else 0
-            print(f"  [{idx+1}/{total}] House#: {found_housenumber}, Postcode: {found_postcode}, Failed: {failed} | {remaining/60:.1f}m remaining")
-
-        # Rate limiting
-        time.sleep(delay)
+    # Persistent cache so re-runs and neighbouring buildings reuse responses
+    GEOCODE_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with shelve.open(str(GEOCODE_CACHE_PATH)) as cache:
+        stats = asyncio.run(_run_batch_async(conn, cache, buildings, delay, start_time, backend))
+    found_housenumber = stats["housenumber"]
+    found_postcode = stats["postcode"]
+    failed = stats["failed"]
 
     elapsed = time.time() - start_time
 
@@ -199,11 +420,11 @@ def run_batch(batch_size: int, delay: float):
     print(f"Found house numbers: {found_housenumber}")
     print(f"Found postcodes: {found_postcode}")
     print(f"Failed: {failed}")
+    print(f"Cache hits: {stats['cache_hits']}")
     print(f"Time: {elapsed/60:.1f} minutes")
     print()
 
     # Show remaining count
-    remaining = get_buildings_needing_addresses(conn, 1)
     cur = conn.cursor()
     cur.execute("SELECT COUNT(*) FROM buildings WHERE addr_housenumber IS NULL AND addr_postcode IS NULL")
     still_need = cur.fetchone()[0]
@@ -220,9 +441,11 @@ def main():
                         help="Number of buildings to process (default: 1000)")
     parser.add_argument("--delay", type=float, default=1.1,
                         help="Delay between requests in seconds (default: 1.1)")
+    parser.add_argument("--backend", choices=["nominatim", "geoapify"], default="nominatim",
+                        help="Reverse geocoder: public Nominatim (default) or Geoapify batch API")
     args = parser.parse_args()
 
-    run_batch(args.batch_size, args.delay)
+    run_batch(args.batch_size, args.delay, args.backend)
 
 
 if __name__ == "__main__":
@@ -20,7 +20,9 @@ Usage:
 
 import argparse
 import json
+import math
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import numpy as np
@@ -72,8 +74,69 @@ def load_aoi_geometry():
     return [aoi["features"][0]["geometry"]]
 
 
-def merge_rasters(input_dir: Path) -> tuple:
-    """Merge multiple raster tiles."""
+# Creation options for the intermediate mosaic: tiled and compressed so the
+# merge can be written window by window straight to disk
+MOSAIC_KWDS = {
+    "compress": "lzw",
+    "tiled": True,
+    "blockxsize": 512,
+    "blockysize": 512,
+    "BIGTIFF": "IF_SAFER",
+}
+
+# Creation options for the clipped outputs: tiled, DEFLATE-compressed DEMs.
+# The predictor is added per dtype (see output_kwds).
+OUTPUT_KWDS = {
+    "driver": "GTiff",
+    "compress": "deflate",
+    "tiled": True,
+    "blockxsize": 512,
+    "blockysize": 512,
+    "BIGTIFF": "IF_SAFER",
+    "num_threads": "all_cpus",
+}
+
+
+def output_kwds(dtype: str) -> dict:
+    """Creation options for an output raster, with the predictor suited to its dtype."""
+    # Floating-point predictor for float DEMs, horizontal differencing otherwise
+    predictor = 3 if np.dtype(dtype).kind == "f" else 2
+    return {**OUTPUT_KWDS, "predictor": predictor}
+
+
+def aoi_merge_bounds(src_files: list, geometries: list) -> tuple:
+    """
+    Bounds of the AOI snapped outward to the tiles' pixel grid and limited to
+    the tiles' extent, so merging within them keeps the source grid intact.
+    """
+    minx, miny, maxx, maxy = shape(geometries[0]).bounds
+    for geom in geometries[1:]:
+        bx0, by0, bx1, by1 = shape(geom).bounds
+        minx, miny, maxx, maxy = min(minx, bx0), min(miny, by0), max(maxx, bx1), max(maxy, by1)
+
+    transform = src_files[0].transform
+    res_x, res_y = transform.a, -transform.e
+    west = transform.c + math.floor((minx - transform.c) / res_x) * res_x
+    east = transform.c + math.ceil((maxx - transform.c) / res_x) * res_x
+    north = transform.f - math.floor((transform.f - maxy) / res_y) * res_y
+    south = transform.f - math.ceil((transform.f - miny) / res_y) * res_y
+
+    west = max(west, min(src.bounds.left for src in src_files))
+    south = max(south, min(src.bounds.bottom for src in src_files))
+    east = min(east, max(src.bounds.right for src in src_files))
+    north = min(north, max(src.bounds.top for src in src_files))
+    if west >= east or south >= north:
+        raise ValueError("Input shapes do not overlap raster.")
+    return west, south, east, north
+
+
+def merge_rasters(input_dir: Path, output_path: Path, geometries: list = None):
+    """
+    Merge multiple raster tiles into a mosaic GeoTIFF on disk.
+
+    With geometries, only the pixels within their (grid-snapped) bounds are
+    merged, so tiles or tile areas outside the AOI are never read or written.
+    """
     tif_files = list(input_dir.glob("*.tif"))
     if not tif_files:
         raise FileNotFoundError(f"No .tif files found in {input_dir}")
@@ -81,37 +144,25 @@ def merge_rasters(input_dir: Path) -> tuple:
     print(f"  Found {len(tif_files)} tiles")
 
     src_files = [rasterio.open(f) for f in tif_files]
-    mosaic, out_transform = merge(src_files)
-
-    # Get metadata from first file
-    out_meta = src_files[0].meta.copy()
-    out_meta.update({
-        "height": mosaic.shape[1],
-        "width": mosaic.shape[2],
-        "transform": out_transform
-    })
-
-    for src in src_files:
-        src.close()
-
-    return mosaic, out_meta
+    try:
+        bounds = aoi_merge_bounds(src_files, geometries) if geometries else None
+        merge(src_files, bounds=bounds, dst_path=output_path, dst_kwds=MOSAIC_KWDS)
+    finally:
+        for src in src_files:
+            src.close()
 
 
-def clip_raster(raster: np.ndarray, meta: dict, geometries: list, output_path: Path):
+def clip_raster(mosaic_path: Path, geometries: list, output_path: Path):
     """Clip raster to geometry and save."""
-    # Create temporary in-memory file for clipping
-    with rasterio.MemoryFile() as memfile:
-        with memfile.open(**meta) as src:
-            src.write(raster)
-
-        with memfile.open() as src:
-            clipped, clipped_transform = mask(src, geometries, crop=True)
-            clipped_meta = src.meta.copy()
-            clipped_meta.update({
-                "height": clipped.shape[1],
-                "width": clipped.shape[2],
-                "transform": clipped_transform
-            })
+    with rasterio.open(mosaic_path) as src:
+        clipped, clipped_transform = mask(src, geometries, crop=True)
+        clipped_meta = src.meta.copy()
+        clipped_meta.update({
+            "height": clipped.shape[1],
+            "width": clipped.shape[2],
+            "transform": clipped_transform
+        })
+        clipped_meta.update(output_kwds(clipped_meta["dtype"]))
 
     # Write output
     with rasterio.open(output_path, "w", **clipped_meta) as dst:
@@ -134,13 +185,17 @@ def process_raster(input_dir: Path, output_file: Path, aoi_geom: list, name: str
         print(f"  No .tif files found in {input_dir}")
         return False
 
-    # Merge tiles
+    # Merge the tiles covering the AOI into a temporary mosaic beside the output
     print("  Merging tiles...")
-    mosaic, meta = merge_rasters(input_dir)
+    mosaic_path = output_file.with_name(f"{output_file.stem}_mosaic.tif")
+    merge_rasters(input_dir, mosaic_path, aoi_geom)
 
     # Clip to AOI
     print("  Clipping to AOI...")
-    clip_raster(mosaic, meta, aoi_geom, output_file)
+    try:
+        clip_raster(mosaic_path, aoi_geom, output_file)
+    finally:
+        mosaic_path.unlink(missing_ok=True)
     return True
 
 
@@ -194,24 +249,25 @@ def main(twin_id: str | None = None):
     dtm_output = _interim_dir / "dtm_clip.tif"
     dsm_output = _interim_dir / "dsm_clip.tif"
 
-    dtm_success = False
-    dsm_success = False
-
-    # Process DTM
-    dtm_success = process_raster(
-        _raw_dir / "lidar_dtm",
-        dtm_output,
-        aoi_geom,
-        "DTM"
-    )
-
-    # Process DSM (optional)
-    dsm_success = process_raster(
-        _raw_dir / "lidar_dsm",
-        dsm_output,
-        aoi_geom,
-        "DSM"
-    )
+    # Process DTM and DSM (optional) side by side; they share no inputs or
+    # outputs, and separate processes keep GDAL work fully parallel
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        dtm_future = executor.submit(
+            process_raster,
+            _raw_dir / "lidar_dtm",
+            dtm_output,
+            aoi_geom,
+            "DTM"
+        )
+        dsm_future = executor.submit(
+            process_raster,
+            _raw_dir / "lidar_dsm",
+            dsm_output,
+            aoi_geom,
+            "DSM"
+        )
+        dtm_success = dtm_future.result()
+        dsm_success = dsm_future.result()
 
     if dtm_success and dsm_success:
         # Verify alignment
@@ -10,25 +10,60 @@ Input:
 
 Output:
     - data/[twins/{id}/]interim/ndsm_clip.tif
+      (uint16 centimetres, band scale 0.01, nodata 65535; float32 metres
+      with --emit-float32)
 
 Usage:
     python 40_compute_ndsm.py --twin-id <uuid>
     python 40_compute_ndsm.py  # Uses default Blyth paths
+    python 40_compute_ndsm.py --emit-float32
 """
 
 import argparse
+import os
 import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import numpy as np
 import rasterio
+from rasterio.windows import Window
 import yaml
 
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
 # Paths
 SCRIPT_DIR = Path(__file__).parent
 PIPELINE_DIR = SCRIPT_DIR.parent
 sys.path.insert(0, str(PIPELINE_DIR))
 
+# Rows per strip when computing the nDSM, bounding memory to a few strips
+NDSM_WINDOW_ROWS = 512
+
+# Threads computing nDSM strips
+NDSM_WORKERS = os.cpu_count() or 4
+
+# Creation options for the nDSM: tiled to match the strip height, DEFLATE-compressed
+OUTPUT_KWDS = {
+    "driver": "GTiff",
+    "compress": "deflate",
+    "tiled": True,
+    "blockxsize": 512,
+    "blockysize": NDSM_WINDOW_ROWS,
+    "BIGTIFF": "IF_SAFER",
+    "num_threads": "all_cpus",
+}
+
+# Quantised nDSM encoding: uint16 centimetres, read back via the band scale
+NDSM_SCALE = 0.01
+NDSM_NODATA_U16 = 65535
+
 # Module-level path variables (set by get_twin_paths)
 _config_dir: Path = None
 _interim_dir: Path = None
@@ -66,49 +101,159 @@ def load_settings() -> dict:
     }
 
 
-def compute_ndsm(dtm_path: Path, dsm_path: Path, output_path: Path, min_height: float = 0, max_height: float = 80):
+if HAS_NUMBA:
+    @njit(cache=True, nogil=True)
+    def _ndsm_kernel(dtm, dsm, nodata, has_nodata, min_height, max_height, out, valid):
+        """Subtract, clamp and mask nodata for one strip in a single pass."""
+        lo = np.float32(min_height)
+        hi = np.float32(max_height)
+        for i in range(dtm.shape[0]):
+            for j in range(dtm.shape[1]):
+                d = dtm[i, j]
+                s = dsm[i, j]
+                if has_nodata and (d == nodata or s == nodata):
+                    valid[i, j] = False
+                    continue
+                valid[i, j] = True
+                v = np.float32(s) - np.float32(d)
+                out[i, j] = lo if v < lo else (hi if v > hi else v)
+
+
+def compute_ndsm_strip(dtm: np.ndarray, dsm: np.ndarray, nodata, min_height: float, max_height: float,
+                       emit_float32: bool) -> tuple[np.ndarray, tuple | None]:
+    """Compute one nDSM strip; returns (output array, (min, max, sum, count, >2.5m count) or None)."""
+    fill = nodata if nodata else 0
+
+    # Handle nodata: only valid pixels are subtracted and clamped,
+    # the rest keep the fill value the buffer starts with
+    if HAS_NUMBA:
+        ndsm = np.full(dtm.shape, fill, dtype=np.float32)
+        valid_mask = np.empty(dtm.shape, dtype=np.bool_)
+        _ndsm_kernel(dtm, dsm, fill, bool(nodata), min_height, max_height, ndsm, valid_mask)
+        valid_ndsm = ndsm[valid_mask]
+    elif nodata:
+        valid_mask = (dtm != nodata) & (dsm != nodata)
+        ndsm = np.full(dtm.shape, fill, dtype=np.float32)
+        np.subtract(dsm, dtm, out=ndsm, where=valid_mask)
+        np.clip(ndsm, min_height, max_height, out=ndsm, where=valid_mask)
+        valid_ndsm = ndsm[valid_mask]
+    else:
+        ndsm = np.subtract(dsm, dtm, dtype=np.float32)
+        np.clip(ndsm, min_height, max_height, out=ndsm)
+        valid_ndsm = ndsm.ravel()
+
+    stats = None
+    if valid_ndsm.size:
+        stats = (
+            float(valid_ndsm.min()),
+            float(valid_ndsm.max()),
+            float(valid_ndsm.sum(dtype=np.float64)),
+            valid_ndsm.size,
+            int(np.count_nonzero(valid_ndsm > 2.5)),
+        )
+
+    if emit_float32:
+        return ndsm, stats
+
+    # Quantise to centimetres in place, keeping 65535 for nodata
+    np.multiply(ndsm, 1 / NDSM_SCALE, out=ndsm)
+    np.rint(ndsm, out=ndsm)
+    np.clip(ndsm, 0, NDSM_NODATA_U16 - 1, out=ndsm)
+    ndsm_cm = ndsm.astype(np.uint16)
+    if nodata:
+        ndsm_cm[~valid_mask] = NDSM_NODATA_U16
+    return ndsm_cm, stats
+
+
+def compute_ndsm(dtm_path: Path, dsm_path: Path, output_path: Path, min_height: float = 0, max_height: float = 80,
+                 emit_float32: bool = False):
     """
     Compute normalized DSM.
 
     nDSM = DSM - DTM, clamped to [min_height, max_height]
+
+    Processed in strips of NDSM_WINDOW_ROWS rows. Strips are computed on a
+    thread pool (NumPy releases the GIL) while the main thread writes
+    finished strips in order, so reads, compute and writes overlap. Written
+    as uint16 centimetres (band scale NDSM_SCALE) unless emit_float32.
     """
-    print("Reading DTM...")
-    with rasterio.open(dtm_path) as dtm_src:
-        dtm = dtm_src.read(1)
+    with rasterio.open(dtm_path) as dtm_src, rasterio.open(dsm_path) as dsm_src:
         meta = dtm_src.meta.copy()
         nodata = dtm_src.nodata
 
-    print("Reading DSM...")
-    with rasterio.open(dsm_path) as dsm_src:
-        dsm = dsm_src.read(1)
-
-    print("Computing nDSM...")
-    # Handle nodata
-    valid_mask = (dtm != nodata) & (dsm != nodata) if nodata else np.ones_like(dtm, dtype=bool)
-
-    ndsm = np.where(valid_mask, dsm - dtm, nodata if nodata else 0)
-
-    # Clamp values
-    ndsm = np.clip(ndsm, min_height, max_height)
-    ndsm = np.where(valid_mask, ndsm, nodata if nodata else 0)
-
-    # Update metadata
-    meta.update(dtype=rasterio.float32)
-
-    print(f"Writing nDSM to {output_path}...")
-    with rasterio.open(output_path, "w", **meta) as dst:
-        dst.write(ndsm.astype(rasterio.float32), 1)
+        # Update metadata
+        meta.update(OUTPUT_KWDS)
+        if emit_float32:
+            meta.update(dtype=rasterio.float32, predictor=3)
+        else:
+            meta.update(dtype=rasterio.uint16, nodata=NDSM_NODATA_U16, predictor=2)
+
+        stats = {"min": np.inf, "max": -np.inf, "sum": 0.0, "count": 0, "buildings": 0}
+
+        # Dataset handles are not thread-safe, so reads from each source are
+        # serialised; the two locks let one worker's DTM read overlap another's
+        # DSM read. Each thread reads into its own reusable strip buffers.
+        read_locks = {"dtm": threading.Lock(), "dsm": threading.Lock()}
+        buffers = threading.local()
+
+        def read_strip(name: str, src, window: Window) -> np.ndarray:
+            buf = getattr(buffers, name, None)
+            if buf is None:
+                buf = np.empty((NDSM_WINDOW_ROWS, src.width), dtype=src.dtypes[0])
+                setattr(buffers, name, buf)
+            out = buf[:window.height]
+            with read_locks[name]:
+                src.read(1, window=window, out=out)
+            return out
+
+        def process_window(window: Window):
+            dtm = read_strip("dtm", dtm_src, window)
+            dsm = read_strip("dsm", dsm_src, window)
+            return window, *compute_ndsm_strip(dtm, dsm, nodata, min_height, max_height, emit_float32)
+
+        windows = [
+            Window(0, row, dtm_src.width, min(NDSM_WINDOW_ROWS, dtm_src.height - row))
+            for row in range(0, dtm_src.height, NDSM_WINDOW_ROWS)
+        ]
+
+        print(f"Computing nDSM to {output_path}...")
+        with rasterio.open(output_path, "w", **meta) as dst, \
+                ThreadPoolExecutor(max_workers=NDSM_WORKERS) as executor:
+            if not emit_float32:
+                dst.scales = (NDSM_SCALE,)
+
+            def write_strip(future):
+                window, strip, strip_stats = future.result()
+                dst.write(strip, 1, window=window)
+                if strip_stats:
+                    strip_min, strip_max, strip_sum, strip_count, strip_buildings = strip_stats
+                    stats["min"] = min(stats["min"], strip_min)
+                    stats["max"] = max(stats["max"], strip_max)
+                    stats["sum"] += strip_sum
+                    stats["count"] += strip_count
+                    stats["buildings"] += strip_buildings
+
+            # Keep at most two strips per worker in flight to bound memory
+            pending = deque()
+            for window in windows:
+                pending.append(executor.submit(process_window, window))
+                if len(pending) >= 2 * NDSM_WORKERS:
+                    write_strip(pending.popleft())
+            while pending:
+                write_strip(pending.popleft())
 
     # Statistics
-    valid_ndsm = ndsm[valid_mask]
+    if not stats["count"]:
+        print("\nNo valid nDSM pixels")
+        return
     print(f"\nStatistics:")
-    print(f"  Min height: {valid_ndsm.min():.2f} m")
-    print(f"  Max height: {valid_ndsm.max():.2f} m")
-    print(f"  Mean height: {valid_ndsm.mean():.2f} m")
-    print(f"  Pixels > 2.5m (likely buildings): {(valid_ndsm > 2.5).sum():,}")
+    print(f"  Min height: {stats['min']:.2f} m")
+    print(f"  Max height: {stats['max']:.2f} m")
+    print(f"  Mean height: {stats['sum'] / stats['count']:.2f} m")
+    print(f"  Pixels > 2.5m (likely buildings): {stats['buildings']:,}")
 
 
-def main(twin_id: str | None = None):
+def main(twin_id: str | None = None, emit_float32: bool = False):
     """Compute nDSM."""
     # Initialize paths
     get_twin_paths(twin_id)
@@ -136,7 +281,8 @@ def main(twin_id: str | None = None):
     min_height = settings.get("buildings", {}).get("min_height_m", 0)
     max_height = settings.get("buildings", {}).get("max_height_m", 80)
 
-    compute_ndsm(dtm_path, dsm_path, ndsm_path, min_height=0, max_height=max_height)
+    compute_ndsm(dtm_path, dsm_path, ndsm_path, min_height=0, max_height=max_height,
+                 emit_float32=emit_float32)
 
     print("\nDone!")
     return 0
@@ -145,6 +291,8 @@ def main(twin_id: str | None = None):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Compute normalized DSM")
     parser.add_argument("--twin-id", help="Twin UUID for twin-specific execution")
+    parser.add_argument("--emit-float32", action="store_true",
+                        help="Write float32 metres instead of uint16 centimetres")
     args = parser.parse_args()
 
-    sys.exit(main(args.twin_id))
+    sys.exit(main(args.twin_id, args.emit_float32))
@@ -23,26 +23,49 @@ Usage:
 """
 
 import argparse
-import json
+import io
 import os
 import re
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
 
 import numpy as np
 import psycopg2
 import rasterio
-from rasterio.mask import mask
+from rasterio.features import geometry_mask
+from rasterio.windows import Window
+import shapely
 from shapely.geometry import shape, mapping
-from shapely import wkb
 import yaml
 
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
 # Paths
 SCRIPT_DIR = Path(__file__).parent
 CONFIG_DIR = SCRIPT_DIR.parent / "config"
 DATA_DIR = SCRIPT_DIR.parent.parent / "data"
 INTERIM_DIR = DATA_DIR / "interim"
 
+# OSM height values: a number with an optional "m" suffix
+HEIGHT_RE = re.compile(r"([\d.]+)\s*m?")
+
+# Buildings streamed from PostGIS (and staged for UPDATE) per batch
+BUILDING_BATCH_SIZE = 5000
+
+# nDSM sampling: footprints per worker chunk, and worker processes
+NDSM_CHUNK_SIZE = 500
+NDSM_WORKERS = os.cpu_count() or 4
+
+# GDAL settings for nDSM reads: per-worker block cache (MB), and no
+# directory listing on open (scale/offset live inside the GeoTIFF)
+NDSM_GDAL_ENV = {"GDAL_CACHEMAX": 256, "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR"}
+
 # Module-level paths
 _config_dir = CONFIG_DIR
 _interim_dir = INTERIM_DIR
@@ -87,7 +110,12 @@ def parse_height(height_str: str) -> float | None:
     if not height_str:
         return None
 
-    match = re.match(r"([\d.]+)\s*m?", str(height_str).strip())
+    height_str = str(height_str).strip()
+    # Plain numbers ("10.5") are the common case and skip the regex
+    if height_str.isascii() and height_str.replace(".", "", 1).isdigit():
+        return float(height_str)
+
+    match = HEIGHT_RE.match(height_str)
     if match:
         try:
             return float(match.group(1))
@@ -96,32 +124,223 @@ def parse_height(height_str: str) -> float | None:
     return None
 
 
-def get_ndsm_height(geometry, ndsm_src, percentile: int = 90) -> float | None:
-    """Extract height from nDSM using percentile within footprint.
+def resolve_osm_height(osm_height_str, levels, storey_height: float) -> tuple:
+    """Height from OSM data: 'height' tag first, then building:levels.
+
+    Returns (height, source), or (None, None) if neither gives a height.
+    """
+    # Priority 1: OSM height tag
+    if osm_height_str:
+        height = parse_height(osm_height_str)
+        if height:
+            return height, "osm_height"
+
+    # Priority 2: OSM building:levels
+    if levels:
+        try:
+            return int(levels) * storey_height, "osm_levels"
+        except (ValueError, TypeError):
+            pass
+
+    return None, None
+
+
+if HAS_NUMBA:
+    @njit(cache=True, nogil=True)
+    def _grouped_percentile_kernel(values, starts, counts, q, out):
+        """Select and interpolate each group's percentile (linear) in O(n)."""
+        for g in range(counts.shape[0]):
+            n = counts[g]
+            position = (n - 1) * q
+            lower = int(np.floor(position))
+            upper = min(lower + 1, n - 1)
+            gamma = position - lower
+
+            # Introselect the upper order statistic; the lower one is the
+            # largest value left of it
+            group = np.partition(values[starts[g]:starts[g] + n], upper)
+            above = np.float64(group[upper])
+            below = np.float64(group[:upper].max()) if lower < upper else above
+
+            diff = above - below
+            if gamma >= 0.5:
+                out[g] = above - diff * (1 - gamma)
+            else:
+                out[g] = below + diff * gamma
+
+
+def grouped_percentile(groups: list, percentile: float) -> np.ndarray:
+    """Linear-interpolated percentile of each array in groups.
+
+    All groups are sorted together in one lexsort instead of one
+    np.percentile call per group (or selected per group by a compiled
+    kernel when numba is available); results match np.percentile's
+    default (linear) method.
+    """
+    counts = np.array([len(g) for g in groups])
+    values = np.concatenate(groups)
+    if HAS_NUMBA and np.issubdtype(values.dtype, np.integer):
+        # Integer (quantised) nDSMs interpolate in float64, as the kernel does
+        starts = np.cumsum(counts) - counts
+        result = np.empty(len(groups), dtype=np.float64)
+        _grouped_percentile_kernel(values, starts, counts, percentile / 100, result)
+        return result
+
+    labels = np.repeat(np.arange(len(groups)), counts)
+    values = values[np.lexsort((values, labels))]
+    starts = np.cumsum(counts) - counts
+
+    # Like np.percentile, interpolate float rasters in their own precision
+    dtype = values.dtype.type if np.issubdtype(values.dtype, np.floating) else np.float64
+    values = values.astype(dtype, copy=False)
+    position = (counts - 1) * (percentile / 100)
+    lower = np.floor(position).astype(np.intp)
+    upper = np.minimum(lower + 1, counts - 1)
+    gamma = position - lower
+
+    below = values[starts + lower]
+    above = values[starts + upper]
+    diff = above - below
+    result = below + diff * gamma.astype(dtype)
+    np.subtract(above, diff * (1 - gamma).astype(dtype), out=result, where=gamma >= 0.5)
+    return result
+
+
+def get_ndsm_heights(geometries: dict, ndsm_src, percentile: int = 90) -> dict:
+    """Extract heights from nDSM for many footprints with one raster read.
+
+    The window covering every footprint is read once; each footprint is
+    then masked (all_touched) against that in-memory array, so adjacent
+    buildings keep the boundary pixels they share.
 
     Args:
-        geometry: Shapely geometry in BNG (EPSG:27700)
+        geometries: Mapping of key -> Shapely geometry in BNG (EPSG:27700)
         ndsm_src: Open rasterio dataset
         percentile: Percentile to use (default 90th)
-    """
-    try:
-        # Create GeoJSON-like dict from shapely geometry (already in BNG)
-        geom_dict = mapping(geometry)
 
-        # Mask nDSM to building footprint
-        out_image, _ = mask(ndsm_src, [geom_dict], crop=True, all_touched=True)
-        data = out_image[0]
+    Returns:
+        Mapping of key -> height in metres, or None if no valid pixels
+    """
+    heights = {key: None for key in geometries}
+
+    # Pixel windows for every footprint bbox at once (as geometry_window)
+    all_keys = list(geometries)
+    bounds = shapely.bounds(np.array([geometries[k] for k in all_keys], dtype=object))
+    inverse = ~ndsm_src.transform
+    xs, ys = bounds[:, [0, 2, 2, 0]], bounds[:, [1, 1, 3, 3]]
+    cols = xs * inverse.a + ys * inverse.b + inverse.c
+    rows = xs * inverse.d + ys * inverse.e + inverse.f
+    with np.errstate(invalid="ignore"):
+        row_start = np.clip(np.floor(rows.min(axis=1)), 0, ndsm_src.height)
+        row_stop = np.clip(np.ceil(rows.max(axis=1)), 0, ndsm_src.height)
+        col_start = np.clip(np.floor(cols.min(axis=1)), 0, ndsm_src.width)
+        col_stop = np.clip(np.ceil(cols.max(axis=1)), 0, ndsm_src.width)
+        # Empty geometries have NaN bounds; footprints off the raster are empty
+        overlaps = (row_stop > row_start) & (col_stop > col_start)
+    if not overlaps.any():
+        return heights
+
+    windows = {
+        all_keys[i]: Window(int(col_start[i]), int(row_start[i]),
+                            int(col_stop[i] - col_start[i]), int(row_stop[i] - row_start[i]))
+        for i in np.flatnonzero(overlaps)
+    }
+    row_off, row_end = int(row_start[overlaps].min()), int(row_stop[overlaps].max())
+    col_off, col_end = int(col_start[overlaps].min()), int(col_stop[overlaps].max())
+    data = ndsm_src.read(
+        1, window=Window(col_off, row_off, col_end - col_off, row_end - row_off)
+    )
+
+    nodata = ndsm_src.nodata
+    keys, samples = [], []
+    for key, window in windows.items():
+        height, width = int(window.height), int(window.width)
+        row, col = int(window.row_off) - row_off, int(window.col_off) - col_off
+        try:
+            inside = geometry_mask(
+                [mapping(geometries[key])],
+                out_shape=(height, width),
+                transform=ndsm_src.window_transform(window),
+                all_touched=True,
+                invert=True,
+            )
+        except Exception:
+            continue
+        values = data[row:row + height, col:col + width][inside]
 
         # Filter valid values (> 0, not nodata)
-        nodata = ndsm_src.nodata
-        valid = data[(data > 0) & (data != nodata)] if nodata else data[data > 0]
+        valid = values[(values > 0) & (values != nodata)] if nodata else values[values > 0]
+        if len(valid):
+            keys.append(key)
+            samples.append(valid)
 
-        if len(valid) == 0:
-            return None
+    if samples:
+        # Quantised nDSMs store centimetres; the band scale/offset give metres
+        values = grouped_percentile(samples, percentile).astype(np.float64)
+        values = values * ndsm_src.scales[0] + ndsm_src.offsets[0]
+        heights.update(zip(keys, values.tolist()))
+
+    return heights
+
+
+def sample_ndsm_chunk(ndsm_path: Path, geometries: dict, percentile: int) -> dict:
+    """Worker: sample one chunk of footprints with its own nDSM handle."""
+    with rasterio.Env(**NDSM_GDAL_ENV), rasterio.open(ndsm_path) as ndsm_src:
+        return get_ndsm_heights(geometries, ndsm_src, percentile)
+
+
+def sample_ndsm_heights(ndsm_path: Path, geometries: dict, percentile: int = 90,
+                        pool: ProcessPoolExecutor = None) -> dict:
+    """Sample nDSM heights for all footprints across worker processes.
+
+    Footprints are ordered south to north before chunking so each chunk's
+    covering window is a narrow band of the raster rather than all of it.
+    Pass a pool to reuse worker processes across calls.
+    """
+    items = sorted(geometries.items(), key=lambda kv: (kv[1].bounds[1], kv[1].bounds[0]))
+    chunks = [
+        dict(items[i:i + NDSM_CHUNK_SIZE])
+        for i in range(0, len(items), NDSM_CHUNK_SIZE)
+    ]
+    if len(chunks) <= 1:
+        return sample_ndsm_chunk(ndsm_path, geometries, percentile)
+    if pool is None:
+        with ProcessPoolExecutor(max_workers=min(NDSM_WORKERS, len(chunks))) as pool:
+            return sample_ndsm_heights(ndsm_path, geometries, percentile, pool)
+
+    heights = {}
+    for result in pool.map(sample_ndsm_chunk, repeat(ndsm_path), chunks, repeat(percentile)):
+        heights.update(result)
+    return heights
+
+
+def create_height_stage(cur):
+    """Create the temp table that COPY stages (height, height_source, id) rows in."""
+    cur.execute("""
+        CREATE TEMP TABLE building_heights_stage (
+            height REAL,
+            height_source TEXT,
+            id BIGINT
+        ) ON COMMIT DROP
+    """)
+
+
+def stage_heights(cur, rows: list):
+    """COPY (height, height_source, id) rows into the stage table."""
+    buf = io.StringIO("".join(f"{h}\t{src}\t{bid}\n" for h, src, bid in rows))
+    cur.copy_from(buf, "building_heights_stage", columns=("height", "height_source", "id"))
 
-        return float(np.percentile(valid, percentile))
-    except Exception:
-        return None
+
+def apply_staged_heights(cur):
+    """Write every staged height back to buildings in one UPDATE ... FROM join."""
+    # JIT compilation only adds planning time to this one-off bulk join
+    cur.execute("SET LOCAL jit = off")
+    cur.execute("""
+        UPDATE buildings b
+        SET height = s.height, height_source = s.height_source, updated_at = NOW()
+        FROM building_heights_stage s
+        WHERE b.id = s.id
+    """)
 
 
 def derive_heights(conn, ndsm_path: Path, settings: dict):
@@ -131,67 +350,27 @@ def derive_heights(conn, ndsm_path: Path, settings: dict):
     min_height = settings["buildings"]["min_height_m"]
     max_height = settings["buildings"]["max_height_m"]
 
-    print(f"Opening nDSM: {ndsm_path}...")
-    ndsm_src = rasterio.open(ndsm_path)
-
     cur = conn.cursor()
-
-    # Get all buildings that need height calculation
-    # Include OSM height tag from stored tags for priority 1
-    cur.execute("""
-        SELECT id, osm_id, geometry, levels, tags
-        FROM buildings
-        ORDER BY id
-    """)
-
-    buildings = cur.fetchall()
-    total = len(buildings)
+    cur.execute("SELECT COUNT(*) FROM buildings")
+    total = cur.fetchone()[0]
     print(f"Processing {total} buildings...")
 
     # Statistics
     stats = {"osm_height": 0, "osm_levels": 0, "lidar": 0, "default": 0}
-    batch_updates = []
-
-    for i, (building_id, osm_id, geom_wkb, levels, tags_json) in enumerate(buildings):
-        height = None
-        source = None
-
-        # Parse tags JSON
-        try:
-            tags = json.loads(tags_json) if tags_json else {}
-        except (json.JSONDecodeError, TypeError):
-            tags = {}
-
-        # Priority 1: OSM height tag
-        osm_height_str = tags.get("height")
-        if osm_height_str:
-            height = parse_height(osm_height_str)
-            if height:
-                source = "osm_height"
-
-        # Priority 2: OSM building:levels
-        if height is None and levels:
-            try:
-                height = int(levels) * storey_height
-                source = "osm_levels"
-            except (ValueError, TypeError):
-                pass
-
-        # Priority 3: LiDAR nDSM
-        if height is None and geom_wkb:
-            try:
-                # Convert WKB to shapely geometry (already in BNG)
-                geom = wkb.loads(geom_wkb, hex=True)
-                height = get_ndsm_height(geom, ndsm_src, percentile)
-                if height:
-                    source = "lidar"
-            except Exception:
-                pass
+    create_height_stage(cur)
 
-        # Fallback: default height
+    # Priorities 1-2 need no geometry: resolve buildings with an OSM height
+    # tag or levels from a narrow query (the tag is projected from JSONB)
+    cur.execute("""
+        SELECT id, levels, tags->>'height' AS osm_height
+        FROM buildings
+        WHERE tags->>'height' IS NOT NULL OR levels IS NOT NULL
+    """)
+    batch_updates = []
+    for building_id, levels, osm_height_str in cur.fetchall():
+        height, source = resolve_osm_height(osm_height_str, levels, storey_height)
         if height is None:
-            height = 6.0  # 2 storeys
-            source = "default"
+            continue  # Unparseable tag / zero levels: falls through to LiDAR
 
         # Clamp height
         height = max(min_height, min(height, max_height))
@@ -199,23 +378,72 @@ def derive_heights(conn, ndsm_path: Path, settings: dict):
         stats[source] += 1
         batch_updates.append((round(height, 1), source, building_id))
 
-        if (i + 1) % 500 == 0:
-            print(f"  Processed {i + 1}/{total} buildings")
-
-    ndsm_src.close()
-
-    # Batch update
-    print(f"\nUpdating {len(batch_updates)} buildings in PostGIS...")
-
-    update_cur = conn.cursor()
-    update_cur.executemany("""
-        UPDATE buildings
-        SET height = %s, height_source = %s, updated_at = NOW()
-        WHERE id = %s
-    """, batch_updates)
+    stage_heights(cur, batch_updates)
+    processed = len(batch_updates)
+    print(f"  Resolved {processed}/{total} buildings from OSM tags")
+
+    # Stream the remaining buildings (not staged above) through a
+    # server-side cursor so WKB is held one batch at a time. Rows come
+    # north to south (raster row order) so each batch, and each worker
+    # chunk's covering window, spans a narrow band of nDSM blocks.
+    print(f"Sampling LiDAR heights from {ndsm_path}")
+    stream = conn.cursor(name="buildings_iter")
+    stream.itersize = BUILDING_BATCH_SIZE
+    stream.execute("""
+        SELECT b.id, ST_AsBinary(b.geometry)
+        FROM buildings b
+        WHERE NOT EXISTS (
+            SELECT 1 FROM building_heights_stage s WHERE s.id = b.id
+        )
+        ORDER BY ST_YMax(b.geometry) DESC, ST_XMin(b.geometry), b.id
+    """)
 
+    with ProcessPoolExecutor(max_workers=NDSM_WORKERS) as pool:
+        while True:
+            buildings = stream.fetchmany(BUILDING_BATCH_SIZE)
+            if not buildings:
+                break
+
+            # Priority 3: LiDAR nDSM. Parse the batch's binary WKB (already
+            # in BNG) in one call; unparseable footprints become None
+            lidar_ids = [building_id for building_id, geom_wkb in buildings if geom_wkb]
+            geoms = shapely.from_wkb(
+                [bytes(geom_wkb) for _, geom_wkb in buildings if geom_wkb],
+                on_invalid="ignore",
+            )
+            lidar_geoms = {
+                building_id: geom
+                for building_id, geom in zip(lidar_ids, geoms)
+                if geom is not None
+            }
+
+            lidar_heights = sample_ndsm_heights(ndsm_path, lidar_geoms, percentile, pool)
+
+            batch_updates = []
+            for building_id, _ in buildings:
+                height = lidar_heights.get(building_id)
+                source = "lidar"
+
+                # Fallback: default height
+                if not height:
+                    height = 6.0  # 2 storeys
+                    source = "default"
+
+                # Clamp height
+                height = max(min_height, min(height, max_height))
+
+                stats[source] += 1
+                batch_updates.append((round(height, 1), source, building_id))
+
+            stage_heights(cur, batch_updates)
+            processed += len(buildings)
+            print(f"  Processed {processed}/{total} buildings")
+
+    stream.close()
+
+    print(f"\nUpdating {processed} buildings in PostGIS...")
+    apply_staged_heights(cur)
     conn.commit()
-    update_cur.close()
     cur.close()
 
     print(f"\nHeight source breakdown:")
@@ -272,7 +500,7 @@ def derive_heights_no_lidar(conn, settings: dict):
 
     # Get all buildings
     cur.execute("""
-        SELECT id, osm_id, levels, tags
+        SELECT id, osm_id, levels, tags->>'height' AS osm_height
         FROM buildings
         ORDER BY id
     """)
@@ -284,29 +512,8 @@ def derive_heights_no_lidar(conn, settings: dict):
     stats = {"osm_height": 0, "osm_levels": 0, "default": 0}
     batch_updates = []
 
-    for i, (building_id, osm_id, levels, tags_json) in enumerate(buildings):
-        height = None
-        source = None
-
-        try:
-            tags = json.loads(tags_json) if tags_json else {}
-        except (json.JSONDecodeError, TypeError):
-            tags = {}
-
-        # Priority 1: OSM height tag
-        osm_height_str = tags.get("height")
-        if osm_height_str:
-            height = parse_height(osm_height_str)
-            if height:
-                source = "osm_height"
-
-        # Priority 2: OSM building:levels
-        if height is None and levels:
-            try:
-                height = int(levels) * storey_height
-                source = "osm_levels"
-            except (ValueError, TypeError):
-                pass
+    for i, (building_id, osm_id, levels, osm_height_str) in enumerate(buildings):
+        height, source = resolve_osm_height(osm_height_str, levels, storey_height)
 
         # Fallback: default height
         if height is None:
@@ -323,11 +530,9 @@ def derive_heights_no_lidar(conn, settings: dict):
     # Batch update
     print(f"\nUpdating {len(batch_updates)} buildings in PostGIS...")
     update_cur = conn.cursor()
-    update_cur.executemany("""
-        UPDATE buildings
-        SET height = %s, height_source = %s, updated_at = NOW()
-        WHERE id = %s
-    """, batch_updates)
+    create_height_stage(update_cur)
+    stage_heights(update_cur, batch_updates)
+    apply_staged_heights(update_cur)
     conn.commit()
     update_cur.close()
     cur.close()
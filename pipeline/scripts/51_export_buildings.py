@@ -25,7 +25,6 @@ Usage:
 """
 
 import argparse
-import json
 import os
 import sys
 from pathlib import Path
@@ -104,6 +103,7 @@ def export_buildings(conn, output_path: Path):
         # Full Phase 2: merge overrides and mark custom meshes
         query = """
             SELECT
+                b.id,
                 b.osm_id,
                 ST_AsGeoJSON(ST_Transform(
                     COALESCE(o.geometry, b.geometry), 4326
@@ -128,12 +128,12 @@ def export_buildings(conn, output_path: Path):
             LEFT JOIN building_overrides o ON b.osm_id = o.osm_id
             LEFT JOIN building_meshes m ON b.osm_id = m.osm_id
             WHERE b.geometry IS NOT NULL
-            ORDER BY b.id
         """
     elif has_overrides:
         # Only overrides table exists
         query = """
             SELECT
+                b.id,
                 b.osm_id,
                 ST_AsGeoJSON(ST_Transform(
                     COALESCE(o.geometry, b.geometry), 4326
@@ -157,12 +157,12 @@ def export_buildings(conn, output_path: Path):
             FROM buildings b
             LEFT JOIN building_overrides o ON b.osm_id = o.osm_id
             WHERE b.geometry IS NOT NULL
-            ORDER BY b.id
         """
     elif has_meshes:
         # Only meshes table exists
         query = """
             SELECT
+                b.id,
                 b.osm_id,
                 ST_AsGeoJSON(ST_Transform(b.geometry, 4326))::json as geometry,
                 b.height,
@@ -184,12 +184,12 @@ def export_buildings(conn, output_path: Path):
             FROM buildings b
             LEFT JOIN building_meshes m ON b.osm_id = m.osm_id
             WHERE b.geometry IS NOT NULL
-            ORDER BY b.id
         """
     else:
         # Phase 1: simple export without overrides
         query = """
             SELECT
+                b.id,
                 b.osm_id,
                 ST_AsGeoJSON(ST_Transform(b.geometry, 4326))::json as geometry,
                 b.height,
@@ -210,77 +210,72 @@ def export_buildings(conn, output_path: Path):
                 FALSE as has_custom_mesh
             FROM buildings b
             WHERE b.geometry IS NOT NULL
-            ORDER BY b.id
         """
 
+    # PostGIS assembles each Feature; NULL properties and false Phase 2
+    # markers are stripped server-side. COPY streams the features (comma
+    # separated) straight into the file: CSV with control-character quote
+    # and delimiter passes the JSON through unescaped, as JSON text never
+    # contains raw control characters.
+    copy_sql = f"""
+        COPY (
+            SELECT
+                CASE WHEN row_number() OVER (ORDER BY e.id) > 1 THEN ',' ELSE '' END
+                || json_build_object(
+                    'type', 'Feature',
+                    'geometry', e.geometry,
+                    'properties', json_strip_nulls(json_build_object(
+                        'osm_id', e.osm_id,
+                        'height', e.height,
+                        'height_source', e.height_source,
+                        'building:levels', e."building:levels",
+                        'building', e.building,
+                        'name', e.name,
+                        'amenity', e.amenity,
+                        'shop', e.shop,
+                        'office', e.office,
+                        'addr:housenumber', e."addr:housenumber",
+                        'addr:housename', e."addr:housename",
+                        'addr:street', e."addr:street",
+                        'addr:postcode', e."addr:postcode",
+                        'addr:city', e."addr:city",
+                        'addr:suburb', e."addr:suburb",
+                        '_has_override', CASE WHEN e.has_override THEN TRUE END,
+                        '_has_custom_mesh', CASE WHEN e.has_custom_mesh THEN TRUE END
+                    ))
+                )::text
+            FROM ({query}) e
+            ORDER BY e.id
+        ) TO STDOUT WITH (FORMAT csv, DELIMITER E'\\x02', QUOTE E'\\x01')
+    """
+
     print("  Executing export query...")
-    cur.execute(query)
-
-    # Get column names from cursor description
-    columns = [desc[0] for desc in cur.description]
-
-    # Build GeoJSON features
-    features = []
-    overrides_count = 0
-    custom_mesh_count = 0
-
-    for row in cur:
-        row_dict = dict(zip(columns, row))
-
-        # Extract geometry
-        geometry = row_dict.pop('geometry')
-        if geometry is None:
-            continue
-
-        # Track Phase 2 features
-        has_override = row_dict.pop('has_override', False)
-        has_custom_mesh = row_dict.pop('has_custom_mesh', False)
-
-        if has_override:
-            overrides_count += 1
-        if has_custom_mesh:
-            custom_mesh_count += 1
-
-        # Build properties, filtering out None values
-        properties = {}
-        for key, value in row_dict.items():
-            if value is not None:
-                properties[key] = value
-
-        # Add Phase 2 markers if present
-        if has_override:
-            properties['_has_override'] = True
-        if has_custom_mesh:
-            properties['_has_custom_mesh'] = True
-
-        feature = {
-            "type": "Feature",
-            "geometry": geometry,
-            "properties": properties
-        }
-        features.append(feature)
+    _processed_dir.mkdir(parents=True, exist_ok=True)
+    with open(output_path, "wb") as f:
+        f.write(b'{"type":"FeatureCollection","features":[\n')
+        cur.copy_expert(copy_sql, f)
+        f.write(b"]}\n")
+
+    # Counts come from the same rows without building the JSON again
+    cur.execute(f"""
+        SELECT
+            COUNT(*),
+            COUNT(*) FILTER (WHERE e.has_override),
+            COUNT(*) FILTER (WHERE e.has_custom_mesh)
+        FROM ({query}) e
+    """)
+    feature_count, overrides_count, custom_mesh_count = cur.fetchone()
 
     cur.close()
 
-    # Build GeoJSON FeatureCollection
-    geojson = {
-        "type": "FeatureCollection",
-        "features": features
-    }
-
-    # Write output
-    _processed_dir.mkdir(parents=True, exist_ok=True)
-    with open(output_path, 'w') as f:
-        json.dump(geojson, f)
-
-    print(f"\n  Exported {len(features):,} buildings to {output_path}")
+    print(f"\n  Exported {feature_count:,} buildings to {output_path}")
 
     if has_overrides:
         print(f"  Buildings with overrides: {overrides_count:,}")
     if has_meshes:
         print(f"  Buildings with custom meshes: {custom_mesh_count:,}")
 
-    return len(features)
+    return feature_count
 
 
 def print_stats(conn):
@@ -15,11 +15,15 @@ Usage:
     python 52_create_facade_atlas.py
 """
 
+import hashlib
 import json
 import math
-import random
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 
+import numpy as np
 import yaml
 
 try:
@@ -32,26 +36,53 @@ except ImportError:
     ImageFilter = None  # type: ignore
     print("Warning: Pillow not installed. Install with: pip install Pillow")
 
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
 # Paths
 SCRIPT_DIR = Path(__file__).parent
 CONFIG_DIR = SCRIPT_DIR.parent / "config"
 DATA_DIR = SCRIPT_DIR.parent.parent / "data"
 TEXTURE_DIR = DATA_DIR / "processed" / "textures"
 TEXTURE_SOURCE_DIR = DATA_DIR / "raw" / "textures"
+TEXTURE_CACHE_DIR = TEXTURE_SOURCE_DIR / "_cache"
+
+# Seed mixed into procedural tile seeds and cache keys
+TEXTURE_SEED = 2
+
+# Procedural generator version in the tile cache key: bump whenever any
+# generate_* function (or generate_normal_map) changes its output
+TEXTURE_CACHE_VERSION = 1
+
+# Random source for the procedural generators (sampled in batches)
+RNG = np.random.default_rng()
+
+# Worker processes generating atlas tiles
+ATLAS_WORKERS = os.cpu_count() or 4
 
 
 def load_config() -> dict:
     """Load facade configuration."""
     with open(CONFIG_DIR / "facades.yaml") as f:
-        return yaml.safe_load(f)
+        # libyaml's C parser when PyYAML was built with it
+        return yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
 
 
+@lru_cache(maxsize=None)
 def hex_to_rgb(hex_color: str) -> tuple[int, int, int]:
     """Convert hex color to RGB tuple."""
     hex_color = hex_color.lstrip('#')
     return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
 
 
+def _clamp_rgb(base, delta) -> np.ndarray:
+    """Offset RGB color(s) by delta, clamped to 0-255, as uint8."""
+    return np.clip(np.asarray(base, dtype=np.int16) + delta, 0, 255).astype(np.uint8)
+
+
 def generate_brick_texture(width: int, height: int, color: tuple[int, int, int],
                            mortar_color: tuple[int, int, int] = (180, 180, 175)) -> "Image.Image":
     """Generate a procedural brick texture."""
@@ -64,72 +95,58 @@ def generate_brick_texture(width: int, height: int, color: tuple[int, int, int],
     mortar_width = max(2, brick_width // 12)
 
     rows = height // brick_height + 1
+    cols = width // brick_width + 2
+
+    # Brick extents for every (row, col), col running from -1 to cols - 1
+    offsets = np.where(np.arange(rows) % 2 == 1, brick_width // 2, 0)
+    y1 = np.arange(rows)[:, None] * brick_height
+    x1 = np.arange(-1, cols)[None, :] * brick_width + offsets[:, None]
+    y2 = y1 + brick_height - mortar_width
+    x2 = x1 + brick_width - mortar_width
+
+    # Vary brick color slightly
+    jitter = RNG.integers(-15, 16, size=(rows, cols + 1, 3), dtype=np.int16)
+    brick_colors = _clamp_rgb(color, jitter)
 
     for row in range(rows):
-        offset = (brick_width // 2) if row % 2 else 0
-        y1 = row * brick_height
-        y2 = y1 + brick_height - mortar_width
-
-        cols = width // brick_width + 2
-        for col in range(-1, cols):
-            x1 = col * brick_width + offset
-            x2 = x1 + brick_width - mortar_width
-
-            # Vary brick color slightly
-            r = max(0, min(255, color[0] + random.randint(-15, 15)))
-            g = max(0, min(255, color[1] + random.randint(-15, 15)))
-            b = max(0, min(255, color[2] + random.randint(-15, 15)))
-            brick_color = (r, g, b)
-
-            draw.rectangle([x1, y1, x2, y2], fill=brick_color)
-
-            # Add subtle texture variation within brick
-            for _ in range(3):
-                px_min = max(0, int(x1))
-                px_max = min(width - 1, int(x2))
-                py_min = max(0, int(y1))
-                py_max = min(height - 1, int(y2))
-                if px_max > px_min and py_max > py_min:
-                    px = random.randint(px_min, px_max)
-                    py = random.randint(py_min, py_max)
-                    variation = random.randint(-10, 10)
-                    pcolor = (
-                        max(0, min(255, r + variation)),
-                        max(0, min(255, g + variation)),
-                        max(0, min(255, b + variation))
-                    )
-                    if 0 <= px < width and 0 <= py < height:
-                        img.putpixel((px, py), pcolor)
+        for col in range(cols + 1):
+            draw.rectangle([int(x1[row, col]), int(y1[row, 0]), int(x2[row, col]), int(y2[row, 0])],
+                           fill=tuple(brick_colors[row, col].tolist()))
 
-    return img
+    # Add subtle texture variation within brick: 3 speckles per brick
+    # (inside its on-image extent), scattered into the pixel buffer at once
+    px_min = np.maximum(0, x1)
+    px_max = np.minimum(width - 1, x2)
+    py_min = np.broadcast_to(np.maximum(0, y1), x1.shape)
+    py_max = np.broadcast_to(np.minimum(height - 1, y2), x1.shape)
+    inside = (px_max > px_min) & (py_max > py_min)
+
+    speckles = (3, int(inside.sum()))
+    px = RNG.integers(px_min[inside], px_max[inside] + 1, size=speckles)
+    py = RNG.integers(py_min[inside], py_max[inside] + 1, size=speckles)
+    variation = RNG.integers(-10, 11, size=speckles + (1,), dtype=np.int16)
+    speckle_colors = _clamp_rgb(brick_colors[inside], variation)
+
+    pixels = np.array(img)
+    pixels[py, px] = speckle_colors
+    return Image.fromarray(pixels, 'RGB')
 
 
 def generate_concrete_texture(width: int, height: int, color: tuple[int, int, int]) -> "Image.Image":
     """Generate a procedural concrete texture."""
-    img = Image.new('RGB', (width, height), color)
+    # Add noise variation (one offset per pixel, shared by all channels)
+    noise = RNG.integers(-20, 21, size=(height, width, 1), dtype=np.int16)
+    pixels = _clamp_rgb(color, noise)
+    img = Image.fromarray(pixels, 'RGB')
     draw = ImageDraw.Draw(img)
 
-    # Add noise variation
-    for y in range(height):
-        for x in range(width):
-            noise = random.randint(-20, 20)
-            r = max(0, min(255, color[0] + noise))
-            g = max(0, min(255, color[1] + noise))
-            b = max(0, min(255, color[2] + noise))
-            img.putpixel((x, y), (r, g, b))
-
     # Add some larger patches
-    for _ in range(20):
-        px = random.randint(0, width)
-        py = random.randint(0, height)
-        radius = random.randint(10, 40)
-        variation = random.randint(-15, 15)
-        patch_color = (
-            max(0, min(255, color[0] + variation)),
-            max(0, min(255, color[1] + variation)),
-            max(0, min(255, color[2] + variation))
-        )
-        draw.ellipse([px-radius, py-radius, px+radius, py+radius], fill=patch_color)
+    patch_colors = _clamp_rgb(color, RNG.integers(-15, 16, size=(20, 1), dtype=np.int16))
+    patch_xs = RNG.integers(0, width + 1, size=20).tolist()
+    patch_ys = RNG.integers(0, height + 1, size=20).tolist()
+    patch_radii = RNG.integers(10, 41, size=20).tolist()
+    for px, py, radius, patch_color in zip(patch_xs, patch_ys, patch_radii, patch_colors.tolist()):
+        draw.ellipse([px-radius, py-radius, px+radius, py+radius], fill=tuple(patch_color))
 
     # Slight blur for smoother appearance
     img = img.filter(ImageFilter.GaussianBlur(radius=1))
@@ -148,74 +165,60 @@ def generate_stone_texture(width: int, height: int, color: tuple[int, int, int])
     mortar_width = max(3, stone_width // 15)
 
     rows = height // stone_height + 1
+    cols = width // stone_width + 2
+
+    # Vary offset per (odd) row, stone width and stone color: all at once
+    offsets = RNG.integers(0, stone_width // 2 + 1, size=rows)
+    offsets[::2] = 0
+    widths = stone_width + RNG.integers(-stone_width//8, stone_width//8 + 1, size=(rows, cols + 1))
+    jitter = RNG.integers(-25, 26, size=(rows, cols + 1, 3), dtype=np.int16)
+    stone_colors = _clamp_rgb(color, jitter)
 
     for row in range(rows):
-        # Vary offset per row
-        offset = random.randint(0, stone_width // 2) if row % 2 else 0
         y1 = row * stone_height
         y2 = y1 + stone_height - mortar_width
 
-        cols = width // stone_width + 2
-        for col in range(-1, cols):
-            # Vary stone width slightly
-            sw = stone_width + random.randint(-stone_width//8, stone_width//8)
-            x1 = col * stone_width + offset
-            x2 = x1 + sw - mortar_width
-
-            # Vary stone color
-            r = max(0, min(255, color[0] + random.randint(-25, 25)))
-            g = max(0, min(255, color[1] + random.randint(-25, 25)))
-            b = max(0, min(255, color[2] + random.randint(-25, 25)))
-            stone_color = (r, g, b)
+        for i, col in enumerate(range(-1, cols)):
+            x1 = col * stone_width + int(offsets[row])
+            x2 = x1 + int(widths[row, i]) - mortar_width
 
-            draw.rectangle([x1, y1, x2, y2], fill=stone_color)
+            draw.rectangle([x1, y1, x2, y2], fill=tuple(stone_colors[row, i].tolist()))
 
     return img
 
 
 def generate_metal_texture(width: int, height: int, color: tuple[int, int, int]) -> "Image.Image":
     """Generate a procedural metal cladding texture."""
-    img = Image.new('RGB', (width, height), color)
+    highlight, shadow, streak_color = _clamp_rgb(color, [[30, 30, 30],
+                                                         [-20, -20, -20],
+                                                         [-30, -30, -25]])
+
+    # Vertical ribs: 2px highlight at each rib, 1px shadow just right of it
+    # (shadows first, so a following rib's highlight wins where they meet)
+    pixels = np.empty((height, width, 3), dtype=np.uint8)
+    pixels[:] = color
+    rib_xs = np.arange(0, width, width // 16)
+    pixels[:, rib_xs[rib_xs + 2 < width] + 2] = shadow
+    pixels[:, rib_xs] = highlight
+    pixels[:, rib_xs[rib_xs + 1 < width] + 1] = highlight
+
+    img = Image.fromarray(pixels, 'RGB')
     draw = ImageDraw.Draw(img)
-
-    # Vertical ribs
-    rib_spacing = width // 16
-    for x in range(0, width, rib_spacing):
-        # Highlight
-        highlight = (
-            min(255, color[0] + 30),
-            min(255, color[1] + 30),
-            min(255, color[2] + 30)
-        )
-        draw.line([(x, 0), (x, height)], fill=highlight, width=2)
-
-        # Shadow
-        shadow = (
-            max(0, color[0] - 20),
-            max(0, color[1] - 20),
-            max(0, color[2] - 20)
-        )
-        draw.line([(x + 2, 0), (x + 2, height)], fill=shadow, width=1)
+    streak_color = tuple(streak_color.tolist())
 
     # Add some weathering/dirt streaks
-    for _ in range(10):
-        x = random.randint(0, width)
-        y1 = random.randint(0, height // 2)
-        y2 = y1 + random.randint(50, 150)
-        streak_color = (
-            max(0, color[0] - 30),
-            max(0, color[1] - 30),
-            max(0, color[2] - 25)
-        )
-        draw.line([(x, y1), (x, y2)], fill=streak_color, width=random.randint(1, 3))
+    streak_xs = RNG.integers(0, width + 1, size=10).tolist()
+    streak_y1s = RNG.integers(0, height // 2 + 1, size=10).tolist()
+    streak_lengths = RNG.integers(50, 151, size=10).tolist()
+    streak_widths = RNG.integers(1, 4, size=10).tolist()
+    for x, y1, length, streak_width in zip(streak_xs, streak_y1s, streak_lengths, streak_widths):
+        draw.line([(x, y1), (x, y1 + length)], fill=streak_color, width=streak_width)
 
     return img
 
 
-def generate_texture(name: str, width: int, height: int, fallback_color: str) -> "Image.Image":
+def generate_texture(name: str, width: int, height: int, color: tuple[int, int, int]) -> "Image.Image":
     """Generate a texture based on its name."""
-    color = hex_to_rgb(fallback_color)
-
     if 'brick' in name:
         return generate_brick_texture(width, height, color)
     elif 'stone' in name or 'sandstone' in name or 'limestone' in name:
@@ -224,63 +227,122 @@ def generate_texture(name: str, width: int, height: int, fallback_color: str) ->
         return generate_metal_texture(width, height, color)
     elif 'glass' in name:
         # Glass is mostly transparent/reflective - use solid color
-        img = Image.new('RGB', (width, height), color)
-        # Add slight grid for window frames
-        draw = ImageDraw.Draw(img)
+        pixels = np.empty((height, width, 3), dtype=np.uint8)
+        pixels[:] = color
+        # Add slight grid for window frames (2px columns and rows)
         frame_color = (80, 80, 80)
         spacing = width // 4
-        for x in range(0, width, spacing):
-            draw.line([(x, 0), (x, height)], fill=frame_color, width=2)
-        for y in range(0, height, spacing):
-            draw.line([(0, y), (width, y)], fill=frame_color, width=2)
-        return img
+        frame_xs = np.arange(0, width, spacing)
+        frame_ys = np.arange(0, height, spacing)
+        for frame_x in (frame_xs, frame_xs + 1):
+            pixels[:, frame_x[frame_x < width]] = frame_color
+        for frame_y in (frame_ys, frame_ys + 1):
+            pixels[frame_y[frame_y < height]] = frame_color
+        return Image.fromarray(pixels, 'RGB')
     elif 'wood' in name:
-        # Simple wood grain
-        img = Image.new('RGB', (width, height), color)
-        draw = ImageDraw.Draw(img)
-        for y in range(0, height, 4):
-            grain_color = (
-                max(0, color[0] + random.randint(-20, 20)),
-                max(0, color[1] + random.randint(-20, 20)),
-                max(0, color[2] + random.randint(-20, 20))
-            )
-            draw.line([(0, y), (width, y)], fill=grain_color, width=1)
-        return img
+        # Simple wood grain: every 4th row gets its own jittered color
+        pixels = np.empty((height, width, 3), dtype=np.uint8)
+        pixels[:] = color
+        grain_rows = pixels[::4]
+        grain_rows[:] = _clamp_rgb(color, RNG.integers(-20, 21, size=(len(grain_rows), 1, 3), dtype=np.int16))
+        return Image.fromarray(pixels, 'RGB')
     else:
         return generate_concrete_texture(width, height, color)
 
 
+if HAS_NUMBA:
+    # Serial on purpose: tiles already run one per ATLAS_WORKERS process, and
+    # a numba thread pool in each would oversubscribe the CPUs
+    @njit(cache=True)
+    def _sobel_normal(gray, out):
+        """Write interior normals for a grayscale height image."""
+        height, width = gray.shape
+        for y in range(1, height - 1):
+            for x in range(1, width - 1):
+                dx = (np.int16(gray[y, x + 1]) - np.int16(gray[y, x - 1])) / 255.0
+                dy = (np.int16(gray[y + 1, x]) - np.int16(gray[y - 1, x])) / 255.0
+                out[y, x, 0] = np.uint8((dx + 1) * 127.5)
+                out[y, x, 1] = np.uint8((dy + 1) * 127.5)
+
+
 def generate_normal_map(source_img: Image.Image) -> "Image.Image":
     """Generate a simple normal map from a source image."""
     # Convert to grayscale for height
     gray = source_img.convert('L')
     width, height = gray.size
 
-    # Create normal map (RGB where R=X, G=Y, B=Z)
-    normal = Image.new('RGB', (width, height), (128, 128, 255))
-    pixels = normal.load()
-    gray_pixels = gray.load()
+    # Create normal map (RGB where R=X, G=Y, B=Z); edges stay flat
+    normal = np.empty((height, width, 3), dtype=np.uint8)
+    normal[:] = (128, 128, 255)
+
+    if HAS_NUMBA:
+        _sobel_normal(np.asarray(gray), normal)
+        return Image.fromarray(normal, 'RGB')
+
+    g = np.asarray(gray, dtype=np.int16)
+
+    # Sobel-like operator over the interior, as whole-array slices
+    dx = (g[1:-1, 2:] - g[1:-1, :-2]) / 255.0
+    dy = (g[2:, 1:-1] - g[:-2, 1:-1]) / 255.0
+
+    # Convert to normal map format (0-255); Z always points up
+    normal[1:-1, 1:-1, 0] = (dx + 1) * 127.5
+    normal[1:-1, 1:-1, 1] = (dy + 1) * 127.5
 
-    for y in range(1, height - 1):
-        for x in range(1, width - 1):
-            # Sobel-like operator
-            left = gray_pixels[x - 1, y]
-            right = gray_pixels[x + 1, y]
-            up = gray_pixels[x, y - 1]
-            down = gray_pixels[x, y + 1]
+    return Image.fromarray(normal, 'RGB')
 
-            # Calculate normal
-            dx = (right - left) / 255.0
-            dy = (down - up) / 255.0
 
-            # Convert to normal map format (0-255)
-            nx = int((dx + 1) * 127.5)
-            ny = int((dy + 1) * 127.5)
-            nz = 255  # Always pointing up
+def generate_tile_cached(name: str, tile_size: int, color: tuple[int, int, int]) -> tuple:
+    """
+    Generate a procedural tile and its normal map, cached on disk.
 
-            pixels[x, y] = (nx, ny, nz)
+    Tiles are seeded from their inputs, so a cache hit is exactly what
+    generation would have produced.
+    """
+    key = hashlib.sha1(
+        f"{name}|{tile_size}|{tile_size}|{color}|{TEXTURE_SEED}|{TEXTURE_CACHE_VERSION}".encode()
+    ).hexdigest()
+    tex_path = TEXTURE_CACHE_DIR / f"{key}.png"
+    normal_path = TEXTURE_CACHE_DIR / f"{key}_normal.png"
 
-    return normal
+    if tex_path.exists() and normal_path.exists():
+        try:
+            with Image.open(tex_path) as tex_img, Image.open(normal_path) as normal_img:
+                return tex_img.convert('RGB'), normal_img.convert('RGB')
+        except Exception as e:
+            print(f"  Warning: Could not load cached {name}: {e}")
+
+    global RNG
+    RNG = np.random.default_rng(int(key[:16], 16))
+
+    tex_img = generate_texture(name, tile_size, tile_size, color)
+    normal_img = generate_normal_map(tex_img)
+
+    # Write then rename so an interrupted run never leaves a truncated tile
+    TEXTURE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    for img, path in ((tex_img, tex_path), (normal_img, normal_path)):
+        tmp_path = path.with_suffix('.tmp')
+        img.save(tmp_path, 'PNG', compress_level=1)
+        os.replace(tmp_path, path)
+
+    return tex_img, normal_img
+
+
+def build_tile(tex_name: str, tex_info: dict, tile_size: int,
+               fallback_color: tuple[int, int, int]) -> tuple:
+    """Worker: load or generate one atlas tile and its normal map."""
+    # Try to load source texture, fall back to procedural
+    source_path = TEXTURE_SOURCE_DIR / tex_info['source']
+    if source_path.exists() and HAS_PIL:
+        try:
+            tex_img = Image.open(source_path).convert('RGB')
+            tex_img = tex_img.resize((tile_size, tile_size), Image.LANCZOS)
+            return tex_name, tex_img, generate_normal_map(tex_img)
+        except Exception as e:
+            print(f"  Warning: Could not load {source_path}: {e}")
+
+    tex_img, normal_img = generate_tile_cached(tex_name, tile_size, fallback_color)
+    return tex_name, tex_img, normal_img
 
 
 def create_atlas(config: dict) -> tuple[Image.Image, Image.Image, dict]:
@@ -299,43 +361,41 @@ def create_atlas(config: dict) -> tuple[Image.Image, Image.Image, dict]:
     }
 
     textures_config = config['textures']
+    fallback_colors = {
+        tex_name: hex_to_rgb(tex_info['color_fallback'])
+        for tex_name, tex_info in textures_config.items()
+    }
 
-    for tex_name, tex_info in textures_config.items():
-        row, col = tex_info['slot']
-        fallback_color = tex_info['color_fallback']
-
-        # Try to load source texture, fall back to procedural
-        source_path = TEXTURE_SOURCE_DIR / tex_info['source']
-        if source_path.exists() and HAS_PIL:
-            try:
-                tex_img = Image.open(source_path).convert('RGB')
-                tex_img = tex_img.resize((tile_size, tile_size), Image.LANCZOS)
-            except Exception as e:
-                print(f"  Warning: Could not load {source_path}: {e}")
-                tex_img = generate_texture(tex_name, tile_size, tile_size, fallback_color)
-        else:
-            tex_img = generate_texture(tex_name, tile_size, tile_size, fallback_color)
-
-        # Calculate position in atlas
-        x = col * tile_size
-        y = row * tile_size
-
-        # Paste into atlas
-        atlas.paste(tex_img, (x, y))
-
-        # Generate and paste normal map
-        normal_img = generate_normal_map(tex_img)
-        normal_atlas.paste(normal_img, (x, y))
-
-        # Store metadata
-        metadata['textures'][tex_name] = {
-            'slot': [row, col],
-            'uv_offset': [col / config['atlas']['grid'], row / config['atlas']['grid']],
-            'uv_scale': 1.0 / config['atlas']['grid'],
-            'color_fallback': fallback_color
-        }
-
-        print(f"  Added {tex_name} at slot [{row}, {col}]")
+    # Tiles are independent: build them across processes, paste serially
+    workers = max(1, min(ATLAS_WORKERS, len(textures_config)))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(build_tile, tex_name, tex_info, tile_size, fallback_colors[tex_name])
+            for tex_name, tex_info in textures_config.items()
+        ]
+
+        for future in futures:
+            tex_name, tex_img, normal_img = future.result()
+            tex_info = textures_config[tex_name]
+            row, col = tex_info['slot']
+
+            # Calculate position in atlas
+            x = col * tile_size
+            y = row * tile_size
+
+            # Paste tile and its normal map into the atlases
+            atlas.paste(tex_img, (x, y))
+            normal_atlas.paste(normal_img, (x, y))
+
+            # Store metadata
+            metadata['textures'][tex_name] = {
+                'slot': [row, col],
+                'uv_offset': [col / config['atlas']['grid'], row / config['atlas']['grid']],
+                'uv_scale': 1.0 / config['atlas']['grid'],
+                'color_fallback': tex_info['color_fallback']
+            }
+
+            print(f"  Added {tex_name} at slot [{row}, {col}]")
 
     return atlas, normal_atlas, metadata
 
@@ -28,11 +28,16 @@ API Costs (approximate):
 
 import json
 import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from io import BytesIO
 
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from pyproj import Transformer
 from PIL import Image
 
@@ -55,12 +60,94 @@ STREETVIEW_IMG_URL = "https://maps.googleapis.com/maps/api/streetview"
 ESRI_TILE_URL = "https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}"
 TILE_ZOOM = 18  # High detail for building reference
 
+# 8 directions for full 360° coverage with 90° FOV overlap
+HEADINGS = [0, 45, 90, 135, 180, 225, 270, 315]
+
+# Concurrent requests per panorama (Google) and per aerial grid (ESRI):
+# one per heading / per tile of the 3x3 grid
+STREETVIEW_WORKERS = 8
+AERIAL_WORKERS = 9
+
+# Minimum spacing between request starts per host, shared by all threads
+STREETVIEW_INTERVAL_S = 0.1
+AERIAL_INTERVAL_S = 0.05
+
+# Responses worth retrying; Retry-After is honoured, otherwise the backoff is
+# exponential starting at RETRY_BACKOFF_S. The wait holds back the whole host.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 3
+RETRY_BACKOFF_S = 1.0
+
+# Connection-level failures are retried by urllib3 on the same connection
+HTTP_RETRY = Retry(total=3, backoff_factor=0.5, status_forcelist=[])
+
+# Shared keep-alive session: one TLS handshake per host, not per image
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=HTTP_RETRY))
+
+
+class RequestGate:
+    """
+    Spaces request start times at least `interval` seconds apart across threads.
+
+    Acts as a token bucket of capacity one: a caller only sleeps for the
+    residual time since the previous start.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+
+    def wait(self):
+        """Wait until the next request slot is available."""
+        with self._lock:
+            now = time.monotonic()
+            if self._next_start > now:
+                time.sleep(self._next_start - now)
+                now = self._next_start
+            self._next_start = now + self.interval
+
+    def defer(self, seconds: float):
+        """Hold back every caller's next request for at least `seconds`."""
+        with self._lock:
+            self._next_start = max(self._next_start, time.monotonic() + seconds)
+
+
+# One gate per host (metadata and image requests both go to Google)
+STREETVIEW_GATE = RequestGate(STREETVIEW_INTERVAL_S)
+AERIAL_GATE = RequestGate(AERIAL_INTERVAL_S)
+
+
+def retry_delay(resp: requests.Response, attempt: int) -> float:
+    """Seconds to wait before retrying, from Retry-After or exponential backoff."""
+    retry_after = resp.headers.get("Retry-After")
+    if retry_after:
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            pass
+    return RETRY_BACKOFF_S * 2 ** attempt
+
+
+def gated_get(gate: RequestGate, url: str, **kwargs) -> requests.Response:
+    """GET through a host's gate, retrying 429/5xx after deferring the whole gate."""
+    for attempt in range(MAX_RETRIES + 1):
+        gate.wait()
+        resp = SESSION.get(url, **kwargs)
+        if resp.status_code in RETRY_STATUSES and attempt < MAX_RETRIES:
+            # Pause every thread hitting this host, not just this request
+            gate.defer(retry_delay(resp, attempt))
+            continue
+        return resp
+
 
 def load_settings() -> dict:
     """Load settings from config."""
     import yaml
     with open(CONFIG_DIR / "settings.yaml") as f:
-        return yaml.safe_load(f)
+        # libyaml's C parser when PyYAML was built with it
+        return yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
 
 
 def load_aoi_origin() -> tuple[float, float]:
@@ -70,15 +157,18 @@ def load_aoi_origin() -> tuple[float, float]:
     return tuple(aoi["features"][0]["properties"]["centre_bng"])
 
 
-def get_chunk_center_wgs84(chunk_x: int, chunk_y: int, origin: tuple, chunk_size: float) -> tuple[float, float]:
-    """Convert chunk grid coordinates to WGS84 lat/lon."""
-    # Chunk center in BNG (relative to origin)
-    center_x = origin[0] + (chunk_x + 0.5) * chunk_size
-    center_y = origin[1] + (chunk_y + 0.5) * chunk_size
+def get_chunk_centers_wgs84(chunk_coords: list[tuple[int, int]], origin: tuple,
+                            chunk_size: float) -> tuple[np.ndarray, np.ndarray]:
+    """Convert chunk grid coordinates to WGS84 lat/lon arrays in one transform."""
+    coords = np.asarray(chunk_coords, dtype=np.float64).reshape(-1, 2)
+
+    # Chunk centers in BNG (relative to origin)
+    center_x = origin[0] + (coords[:, 0] + 0.5) * chunk_size
+    center_y = origin[1] + (coords[:, 1] + 0.5) * chunk_size
 
     # Convert to WGS84
-    lon, lat = BNG_TO_WGS84.transform(center_x, center_y)
-    return lat, lon
+    lons, lats = BNG_TO_WGS84.transform(center_x, center_y)
+    return lats, lons
 
 
 def get_nearest_panorama(lat: float, lon: float, api_key: str, radius: int = 100) -> dict | None:
@@ -96,7 +186,7 @@ def get_nearest_panorama(lat: float, lon: float, api_key: str, radius: int = 100
     }
 
     try:
-        resp = requests.get(STREETVIEW_META_URL, params=params, timeout=10)
+        resp = gated_get(STREETVIEW_GATE, STREETVIEW_META_URL, params=params, timeout=10)
         resp.raise_for_status()
         data = resp.json()
 
@@ -114,7 +204,7 @@ def get_nearest_panorama(lat: float, lon: float, api_key: str, radius: int = 100
 
 
 def download_streetview_360(pano_id: str, output_dir: Path, api_key: str,
-                            size: str = "640x640", pitch: int = 10) -> int:
+                            size: str = "640x640", pitch: int = 10) -> dict[int, np.ndarray]:
     """
     Download 360° Street View imagery as 8 directional images.
 
@@ -126,74 +216,61 @@ def download_streetview_360(pano_id: str, output_dir: Path, api_key: str,
         pitch: Camera pitch (-90 to 90, positive = up)
 
     Returns:
-        Number of successfully downloaded images
+        Decoded RGB arrays of the successfully downloaded images, by heading
     """
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    # 8 directions for full 360° coverage with 90° FOV overlap
-    headings = [0, 45, 90, 135, 180, 225, 270, 315]
-    success_count = 0
-
-    for heading in headings:
-        params = {
-            "pano": pano_id,
-            "size": size,
-            "heading": heading,
-            "pitch": pitch,
-            "fov": 90,
-            "key": api_key
+    images = {}
+
+    # Request all headings at once; results are handled in heading order
+    with ThreadPoolExecutor(max_workers=STREETVIEW_WORKERS) as pool:
+        futures = {
+            heading: pool.submit(gated_get, STREETVIEW_GATE, STREETVIEW_IMG_URL, timeout=30, params={
+                "pano": pano_id,
+                "size": size,
+                "heading": heading,
+                "pitch": pitch,
+                "fov": 90,
+                "key": api_key
+            })
+            for heading in HEADINGS
         }
 
+    for heading, future in futures.items():
         try:
-            resp = requests.get(STREETVIEW_IMG_URL, params=params, timeout=30)
+            resp = future.result()
 
             if resp.status_code == 200 and len(resp.content) > 1000:
+                # Decode once here so the composite doesn't re-read the files
+                with Image.open(BytesIO(resp.content)) as img:
+                    images[heading] = np.asarray(img.convert("RGB"))
                 img_path = output_dir / f"h{heading:03d}.jpg"
                 img_path.write_bytes(resp.content)
-                success_count += 1
             else:
                 print(f"      Warning: Heading {heading}° returned invalid image")
 
         except Exception as e:
             print(f"      Error downloading heading {heading}°: {e}")
 
-        # Small delay to avoid rate limiting
-        time.sleep(0.1)
+    return images
 
-    return success_count
 
-
-def create_360_composite(input_dir: Path, output_path: Path) -> bool:
+def create_360_composite(images: dict[int, np.ndarray], output_path: Path) -> bool:
     """
     Stitch 8 directional images into a single panoramic strip.
 
     Creates a 5120x640 image (8 × 640px wide).
     """
-    headings = [0, 45, 90, 135, 180, 225, 270, 315]
-    images = []
-
-    for heading in headings:
-        img_path = input_dir / f"h{heading:03d}.jpg"
-        if img_path.exists():
-            images.append(Image.open(img_path))
-        else:
-            # Create placeholder for missing images
-            images.append(Image.new("RGB", (640, 640), (128, 128, 128)))
-
     if not images:
         return False
 
-    # Create horizontal strip
-    width = sum(img.width for img in images)
-    height = images[0].height
-    composite = Image.new("RGB", (width, height))
-
-    x_offset = 0
-    for img in images:
-        composite.paste(img, (x_offset, 0))
-        x_offset += img.width
+    # Grey placeholder for missing headings
+    placeholder = np.full_like(next(iter(images.values())), 128)
+    strips = [images.get(heading, placeholder) for heading in HEADINGS]
 
-    composite.save(output_path, "JPEG", quality=90)
+    # Create horizontal strip
+    composite = np.concatenate(strips, axis=1)
+    Image.fromarray(composite, "RGB").save(output_path, "JPEG", quality=90, optimize=False)
     return True
 
 
@@ -221,22 +298,27 @@ def download_aerial_tile(lat: float, lon: float, output_path: Path,
     grid_size = 3
     canvas = Image.new("RGB", (tile_size * grid_size, tile_size * grid_size), (100, 120, 100))
 
-    for dy in range(-1, 2):
-        for dx in range(-1, 2):
-            tx = center_x + dx
-            ty = center_y + dy
-
-            url = ESRI_TILE_URL.format(z=zoom, x=tx, y=ty)
-
-            try:
-                resp = requests.get(url, timeout=10)
-                if resp.status_code == 200:
-                    img = Image.open(BytesIO(resp.content))
-                    canvas.paste(img, ((dx + 1) * tile_size, (dy + 1) * tile_size))
-            except Exception:
-                pass  # Keep green placeholder
+    # Fetch all grid tiles at once; paste sequentially below
+    offsets = [(dx, dy) for dy in range(-1, 2) for dx in range(-1, 2)]
+    with ThreadPoolExecutor(max_workers=AERIAL_WORKERS) as pool:
+        futures = {
+            (dx, dy): pool.submit(
+                gated_get, AERIAL_GATE, ESRI_TILE_URL.format(z=zoom, x=center_x + dx, y=center_y + dy), timeout=10
+            )
+            for dx, dy in offsets
+        }
 
-            time.sleep(0.05)  # Be nice to ESRI
+    for (dx, dy), future in futures.items():
+        try:
+            resp = future.result()
+            if resp.status_code == 200:
+                img = Image.open(BytesIO(resp.content))
+                canvas.paste(img, ((dx + 1) * tile_size, (dy + 1) * tile_size))
+            else:
+                print(f"      Warning: Aerial tile ({dx}, {dy}) returned HTTP {resp.status_code}")
+        except Exception as e:
+            # Keep green placeholder
+            print(f"      Error downloading aerial tile ({dx}, {dy}): {e}")
 
     # Crop to center
     margin = (tile_size * grid_size - size) // 2
@@ -278,17 +360,21 @@ def process_all_chunks(api_key: str, skip_existing: bool = True):
         "skipped": 0
     }
 
-    for i, chunk_file in enumerate(chunk_files):
-        # Parse chunk coordinates from filename (buildings_X_Y.glb)
+    # Parse chunk coordinates from filenames (buildings_X_Y.glb)
+    chunk_coords = []
+    for chunk_file in chunk_files:
         parts = chunk_file.stem.split("_")
-        chunk_x = int(parts[1])
-        chunk_y = int(parts[2])
+        chunk_coords.append((int(parts[1]), int(parts[2])))
+
+    # Get all chunk centers in WGS84
+    lats, lons = get_chunk_centers_wgs84(chunk_coords, origin, chunk_size)
+
+    for i, (chunk_x, chunk_y) in enumerate(chunk_coords):
         chunk_key = f"{chunk_x}_{chunk_y}"
 
         print(f"[{i+1}/{len(chunk_files)}] Chunk {chunk_key}")
 
-        # Get chunk center in WGS84
-        lat, lon = get_chunk_center_wgs84(chunk_x, chunk_y, origin, chunk_size)
+        lat, lon = float(lats[i]), float(lons[i])
         print(f"  Center: {lat:.6f}, {lon:.6f}")
 
         # Check if already processed
@@ -309,7 +395,8 @@ def process_all_chunks(api_key: str, skip_existing: bool = True):
                 stats["streetview_found"] += 1
 
                 if not (skip_existing and sv_dir.exists()):
-                    img_count = download_streetview_360(pano["pano_id"], sv_dir, api_key)
+                    images = download_streetview_360(pano["pano_id"], sv_dir, api_key)
+                    img_count = len(images)
                     print(f"  Downloaded {img_count}/8 images")
 
                     if img_count > 0:
@@ -317,7 +404,7 @@ def process_all_chunks(api_key: str, skip_existing: bool = True):
 
                         # Create composite
                         composite_path = sv_dir / "composite.jpg"
-                        create_360_composite(sv_dir, composite_path)
+                        create_360_composite(images, composite_path)
                         print(f"  Created composite panorama")
             else:
                 print("  Street View: No coverage")
@@ -330,9 +417,6 @@ def process_all_chunks(api_key: str, skip_existing: bool = True):
 
         print()
 
-        # Rate limiting
-        time.sleep(0.2)
-
     # Summary
     print("=" * 50)
     print("SUMMARY")
@@ -32,9 +32,11 @@ import argparse
 import json
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 import requests
+from requests.adapters import HTTPAdapter
 
 # Paths
 SCRIPT_DIR = Path(__file__).parent
@@ -45,6 +47,14 @@ REFERENCE_DIR = DATA_DIR / "reference"
 # Meshy API
 MESHY_API_URL = "https://api.meshy.ai"
 MESHY_TEXTURE_ENDPOINT = "/v2/text-to-texture"
+MESHY_RETEXTURE_URL = f"{MESHY_API_URL}/openapi/v1/retexture"
+
+# Chunks textured at once (each mostly waits on Meshy)
+MESHY_CONCURRENCY = 8
+
+# Shared keep-alive session for all chunk threads
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=16))
 
 # Default texturing prompt
 DEFAULT_PROMPT = """
@@ -330,11 +340,67 @@ def process_chunk_local(chunk_path: Path, output_dir: Path, refs: dict, prompt:
     return task_info
 
 
+def submit_meshy_task(payload: dict, api_key: str, chunk_key: str) -> str | None:
+    """Create a Meshy retexture task and return its task ID, or None on failure."""
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+
+    resp = SESSION.post(MESHY_RETEXTURE_URL, headers=headers, json=payload, timeout=60)
+
+    if resp.status_code != 202:
+        print(f"    [{chunk_key}] Error creating task: {resp.status_code} {resp.text}")
+        return None
+
+    task_id = resp.json().get("result")
+    print(f"    [{chunk_key}] Task: {task_id}")
+    return task_id
+
+
+def poll_meshy_task(task_id: str, api_key: str, chunk_key: str,
+                    max_polls: int = 60, poll_interval: int = 10) -> dict | None:
+    """
+    Poll a Meshy retexture task until it finishes (up to 10 minutes).
+
+    Returns the task data on SUCCEEDED, None on FAILED or timeout.
+    """
+    last_state = None
+
+    for poll_count in range(max_polls):
+        time.sleep(poll_interval)
+        status_resp = SESSION.get(
+            f"{MESHY_RETEXTURE_URL}/{task_id}",
+            headers={"Authorization": f"Bearer {api_key}"},
+            timeout=30
+        )
+        data = status_resp.json()
+        status = data.get("status")
+        progress = data.get("progress", 0)
+
+        # Only report changes; several chunks share the console
+        if (status, progress) != last_state:
+            print(f"    [{chunk_key}] [{poll_count * poll_interval}s] {status} {progress}%")
+            last_state = (status, progress)
+
+        if status == "SUCCEEDED":
+            return data
+        elif status == "FAILED":
+            error = data.get("task_error", {}).get("message", "unknown")
+            print(f"    [{chunk_key}] Failed: {error}")
+            return None
+
+    print(f"    [{chunk_key}] Timeout waiting for task")
+    return None
+
+
 def texture_chunk_with_meshy(chunk_path: Path, style_image_path: Path, api_key: str,
                              output_dir: Path, max_retries: int = 3) -> bool:
     """
     Send a chunk to Meshy for texturing using a style reference image.
 
+    Safe to call from several threads at once (one chunk per call).
+
     Args:
         chunk_path: Path to the GLB mesh
         style_image_path: Path to style reference (Street View composite or aerial)
@@ -356,12 +422,7 @@ def texture_chunk_with_meshy(chunk_path: Path, style_image_path: Path, api_key:
     with open(style_image_path, "rb") as f:
         img_base64 = base64.b64encode(f.read()).decode()
 
-    print(f"    Style reference: {style_image_path.name}")
-
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
+    print(f"    [{chunk_key}] Style reference: {style_image_path.name}")
 
     payload = {
         "model_url": f"data:application/octet-stream;base64,{glb_base64}",
@@ -373,65 +434,38 @@ def texture_chunk_with_meshy(chunk_path: Path, style_image_path: Path, api_key:
 
     for attempt in range(max_retries):
         try:
-            # Create task
-            resp = requests.post(
-                "https://api.meshy.ai/openapi/v1/retexture",
-                headers=headers,
-                json=payload,
-                timeout=60
-            )
-
-            if resp.status_code != 202:
-                print(f"    Error creating task: {resp.status_code} {resp.text}")
+            task_id = submit_meshy_task(payload, api_key, chunk_key)
+            if task_id is None:
                 continue
 
-            task_id = resp.json().get("result")
-            print(f"    Task: {task_id}")
-
-            # Poll for result (up to 10 minutes)
-            for poll_count in range(60):
-                time.sleep(10)
-                status_resp = requests.get(
-                    f"https://api.meshy.ai/openapi/v1/retexture/{task_id}",
-                    headers={"Authorization": f"Bearer {api_key}"},
-                    timeout=30
-                )
-                data = status_resp.json()
-                status = data.get("status")
-                progress = data.get("progress", 0)
-                print(f"    [{poll_count*10}s] {status} {progress}%", end="\r")
-
-                if status == "SUCCEEDED":
-                    glb_url = data.get("model_urls", {}).get("glb")
-                    if glb_url:
-                        result = requests.get(glb_url, timeout=120)
-                        out_path = output_dir / f"buildings_{chunk_key}.glb"
-                        out_path.parent.mkdir(parents=True, exist_ok=True)
-
-                        # Rescale to match original mesh bounds
-                        out_path_temp = output_dir / f"buildings_{chunk_key}_temp.glb"
-                        out_path_temp.write_bytes(result.content)
-
-                        if rescale_to_original(chunk_path, out_path_temp, out_path):
-                            out_path_temp.unlink()
-                            print(f"\n    Saved (rescaled): {out_path.name}")
-                        else:
-                            out_path_temp.rename(out_path)
-                            print(f"\n    Saved (no rescale): {out_path.name}")
-                        return True
-                    break
-                elif status == "FAILED":
-                    error = data.get("task_error", {}).get("message", "unknown")
-                    print(f"    Failed: {error}")
-                    break
+            data = poll_meshy_task(task_id, api_key, chunk_key)
+
+            if data is not None:
+                glb_url = data.get("model_urls", {}).get("glb")
+                if glb_url:
+                    result = SESSION.get(glb_url, timeout=120)
+                    out_path = output_dir / f"buildings_{chunk_key}.glb"
+                    out_path.parent.mkdir(parents=True, exist_ok=True)
+
+                    # Rescale to match original mesh bounds
+                    out_path_temp = output_dir / f"buildings_{chunk_key}_temp.glb"
+                    out_path_temp.write_bytes(result.content)
+
+                    if rescale_to_original(chunk_path, out_path_temp, out_path):
+                        out_path_temp.unlink()
+                        print(f"    [{chunk_key}] Saved (rescaled): {out_path.name}")
+                    else:
+                        out_path_temp.rename(out_path)
+                        print(f"    [{chunk_key}] Saved (no rescale): {out_path.name}")
+                    return True
 
             # If we get here, task didn't complete successfully
             if attempt < max_retries - 1:
-                print(f"    Retrying ({attempt + 2}/{max_retries})...")
+                print(f"    [{chunk_key}] Retrying ({attempt + 2}/{max_retries})...")
                 time.sleep(30)  # Wait before retry
 
         except Exception as e:
-            print(f"    Error: {e}")
+            print(f"    [{chunk_key}] Error: {e}")
             if attempt < max_retries - 1:
                 time.sleep(30)
 
@@ -446,6 +480,8 @@ def main():
                         help="Prepare task files for manual upload (no API calls)")
     parser.add_argument("--run", action="store_true", help="Actually run texturing via Meshy API")
     parser.add_argument("--max-chunks", type=int, default=5, help="Max chunks to process in one run")
+    parser.add_argument("--max-concurrency", type=int, default=MESHY_CONCURRENCY,
+                        help="Max chunks textured concurrently via Meshy")
     args = parser.parse_args()
 
     api_key = os.environ.get("MESHY_API_KEY")
@@ -486,6 +522,9 @@ def main():
         "skipped": 0
     }
 
+    # (chunk_path, style_ref) pairs to texture via Meshy once all chunks are checked
+    meshy_jobs = []
+
     for i, chunk_path in enumerate(chunk_files):
         chunk_key = chunk_path.stem.replace("buildings_", "")
         print(f"[{i+1}/{len(chunk_files)}] Chunk {chunk_key}")
@@ -517,8 +556,8 @@ def main():
             continue
 
         if args.run:
-            # Run actual Meshy API texturing
-            if stats["processed"] >= args.max_chunks:
+            # Queue chunk for Meshy API texturing
+            if len(meshy_jobs) >= args.max_chunks:
                 print(f"  Skipping (reached max {args.max_chunks} chunks)")
                 stats["skipped"] += 1
                 continue
@@ -534,20 +573,42 @@ def main():
             style_ref = refs["streetview_composite"] or refs["aerial"]
 
             if style_ref:
-                output_dir = PROCESSED_DIR / "buildings_textured"
-                success = texture_chunk_with_meshy(
-                    chunk_path, style_ref, api_key, output_dir
-                )
-                if success:
-                    stats["processed"] += 1
-                else:
-                    stats["failed"] += 1
+                meshy_jobs.append((chunk_path, style_ref))
+                print("  Queued for texturing")
             else:
                 print("  Skipping (no reference imagery)")
                 stats["skipped"] += 1
         else:
             print("  Use --run to process via Meshy API")
 
+    if meshy_jobs:
+        # Tasks spend most of their time queued/polling at Meshy: run several at once
+        workers = max(1, min(args.max_concurrency, len(meshy_jobs)))
+        print()
+        print(f"Texturing {len(meshy_jobs)} chunks ({workers} at a time)...")
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(texture_chunk_with_meshy, chunk_path, style_ref, api_key, output_dir): chunk_path
+                for chunk_path, style_ref in meshy_jobs
+            }
+
+            for future in as_completed(futures):
+                chunk_key = futures[future].stem.replace("buildings_", "")
+                try:
+                    success = future.result()
+                except Exception as e:
+                    # e.g. unreadable GLB/style image; keep counting the others
+                    print(f"  Chunk {chunk_key}: error: {e}")
+                    success = False
+
+                if success:
+                    stats["processed"] += 1
+                    print(f"  Chunk {chunk_key}: textured")
+                else:
+                    stats["failed"] += 1
+                    print(f"  Chunk {chunk_key}: failed")
+
     # Summary
     print()
     print("=" * 50)
@@ -613,7 +613,9 @@ def extrude_detailed_building(geometry_wgs84: dict, height: float, ground_z: flo
             return None
 
         coords_wgs84 = geometry_wgs84['coordinates'][0]
-        coords_bng = [WGS84_TO_BNG.transform(c[0], c[1]) for c in coords_wgs84]
+        # Transform the whole ring in one PROJ call
+        xs, ys = WGS84_TO_BNG.transform([c[0] for c in coords_wgs84], [c[1] for c in coords_wgs84])
+        coords_bng = list(zip(xs, ys))
 
         origin_x, origin_y = origin
         local_coords = [(x - origin_x, y - origin_y) for x, y in coords_bng]
@@ -133,7 +133,9 @@ def create_footprint_mesh(geometry_wgs84: dict, ground_z: float,
             return None, 0
 
         coords_wgs84 = geometry_wgs84['coordinates'][0]
-        coords_bng = [WGS84_TO_BNG.transform(c[0], c[1]) for c in coords_wgs84]
+        # Transform the whole ring in one PROJ call
+        xs, ys = WGS84_TO_BNG.transform([c[0] for c in coords_wgs84], [c[1] for c in coords_wgs84])
+        coords_bng = list(zip(xs, ys))
 
         # Translate to local origin
         origin_x, origin_y = origin